@@ -1,20 +1,17 @@
-import json
 from pathlib import Path
 
-from sqlalchemy import create_engine, text
-
 from shiny import *
 import shinycomponents as sc
 # import shinycomponents.adminlte as sca
 
 import pages
+import data_access
+import energy_dataset
+from shared_dataset import SharedDataset
 
 # from enlighten import enlightenAPI_v4
 
-from datetime import datetime, date, timedelta
-import pandas as pd
 import plotly.io as pio
-import constants as co
 
 import shinycomponents.busyindicator as scb
 
@@ -83,21 +80,15 @@ app_ui = ui.page_navbar(
 )
 
 
-def server(input, output, session):
-    with open('config/enlighten_v4_config.json') as config_file:
-        config = json.load(config_file)
-
+shared_data = SharedDataset(energy_dataset.load_dataset,
+                            lambda: data_access.read_ingest_watermark(*energy_dataset.storage()),
+                            poll_seconds=data_access.app_config().get("dataset_refresh_seconds", 60))
 
-    username = config["db_user"]
-    password = config["db_pwd"]
-    db_name = config["db_name"]
-    host_name = config["host_name"]
-    port = config["port"]
 
-    pcon = create_engine(f"postgresql+psycopg2://{username}:{password}@{host_name}:{port}/{db_name}", echo=True)
+def server(input, output, session):
     # api = enlightenAPI_v4(config)
 
-    data = reactive.Value(pd.DataFrame())
+    shared_data.get()
 
     # def load_telemetry(system_id, type):
     #     with pcon.connect() as connection:
@@ -131,116 +122,36 @@ def server(input, output, session):
     # load_telemetry(system_id, "export")
     # load_telemetry(system_id, "import")
 
-    db_con = reactive.Value(pcon)
-
-    @reactive.Effect
-    def load_data():
-        req(db_con())
-
-
-
-        df_production = pd.read_sql("select * from production_meter", db_con()).rename(
-            columns=co.column_mapping["production"])
-        df_consumption = pd.read_sql("select * from consumption", db_con()).rename(
-            columns=co.column_mapping["consumption"])
-        df_battery = pd.read_sql("select * from battery", db_con()).rename(columns=co.column_mapping["battery"])
-        df_import = pd.read_sql("select * from import", db_con()).rename(columns=co.column_mapping["import"])
-        df_export = pd.read_sql("select * from export", db_con()).rename(columns=co.column_mapping["export"])
-        df_export["Exported"] = -df_export["Exported"]
-        df_consumption["Consumed"] = - df_consumption["Consumed"]
-        df_battery["Charged"] = -df_battery["Charged"]
-
-        df_all = df_import \
-            .merge(df_export, how="left", on=["System Id", "Time"]) \
-            .merge(df_production, how="left", on=["System Id", "Time"]) \
-            .merge(df_consumption, how="left", on=["System Id", "Time"]) \
-            .merge(df_battery, how="left", on=["System Id", "Time"])
-
-        print(df_all.info())
-
-        # Plotly doesn't accept time, so we convert all times to today's datetime
-        df_all["Time of Day"] = df_all["Time"].apply(lambda x: datetime.combine(date.today(), x.time()))
-        df_all["Hour"] = df_all["Time"].dt.floor("H")
-        df_all["Day"] = df_all["Time"].dt.date
-        df_all["Day of Week"] = df_all["Time"].dt.dayofweek
-        df_all["Day of Month"] = df_all["Time"].dt.day
-        df_all["Month"] = df_all["Time"].dt.month
-        df_all["Month Name"] = df_all["Time"].dt.month_name()
-        df_all["Week"] = df_all["Time"].dt.day_of_year.apply(lambda x: x // 7)
-        df_all["Year"] = df_all["Time"].dt.year
-
-        print(df_all.info())
-
-        data.set(df_all)
+    # one dataset per process, loaded by the first session and refreshed in the background when the loader wrote
+    # new telemetry. Sessions switch to a new version within a few seconds
+    @reactive.poll(shared_data.version, 5)
+    def dataset():
+        return shared_data.get()
 
     @reactive.Calc
-    def enriched_data():
-        req(not data().empty)
-
-        df_all = data().copy()
-        # Remove dates from interventions. Outliers are possible for these dates
-        df_all = df_all[~df_all["Day"].isin([date(2023,5,4),date(2023,5,17)])]
-
-        df_max_global = calculate_maximum(df_all, "Produced", "Max Produced (Global)")
-        df_max_by_month = calculate_maximum(df_all, "Produced", "Max Produced (Month)", "Month")
-        df_max_by_week = calculate_maximum(df_all, "Produced", "Max Produced (Week)", "Week")
+    def rollup_data():
+        return dataset()["rollups"]
 
-        df_enriched = data() \
-            .merge(df_max_global, how="left", left_on="Time of Day", right_on="Time of Day") \
-            .merge(df_max_by_month, how="left", left_on=["Month", "Time of Day"], right_on=["Month", "Time of Day"]) \
-            .merge(df_max_by_week, how="left", left_on=["Week", "Time of Day"], right_on=["Week", "Time of Day"])
+    @reactive.Calc
+    def time_extent():
+        return dataset()["extent"]
 
-        return df_enriched
+    # the pages read the intervals of the range they show, older days than the snapshot are read on demand
+    def data_range(start=None, end=None, columns=None):
+        return energy_dataset.energy_range(dataset(), start, end, columns=columns)
 
+    # the envelopes are looked up for the rows a page displays
+    def add_envelopes(df):
+        return energy_dataset.with_envelopes(df, dataset()["envelopes"])
 
-    pages.history.history_server("history", enriched_data)
-    pages.comparison.comp_server("comparison", enriched_data)
-    pages.calendar.calendar_server("calendar", enriched_data)
-    pages.stats.stats_server("stats", enriched_data)
+    pages.history.history_server("history", data_range, rollup_data, time_extent)
+    pages.comparison.comp_server("comparison", data_range, rollup_data)
+    pages.calendar.calendar_server("calendar", data_range, rollup_data, add_envelopes)
+    pages.stats.stats_server("stats", data_range)
 
 app = App(app_ui, server, static_assets=Path.joinpath(Path(__file__).parent, "assets"))
 
 
-
-def calculate_maximum(df, column_name, new_column_name="Max Produced", groupby_column=None):
-    # Overall maximum per quarter
-    # Calculate max production per quarter
-    if groupby_column is None:
-        df_max_by_time = df \
-            .groupby("Time of Day")[column_name] \
-            .max() \
-            .reset_index() \
-            .rename(columns={column_name: new_column_name})
-
-        cummax_left = df_max_by_time[new_column_name].cummax()
-        cummax_right = df_max_by_time[new_column_name] \
-            .sort_index(inplace=False, ascending=False) \
-            .cummax()
-
-    else:
-        df_max_by_time = df \
-            .groupby([groupby_column, "Time of Day"])[column_name] \
-            .max() \
-            .reset_index() \
-            .rename(columns={column_name: new_column_name})
-
-        cummax_left = df_max_by_time \
-            .groupby(groupby_column)[new_column_name] \
-            .cummax() \
-            .rename("Cummax Left")
-        cummax_right = df_max_by_time \
-            .sort_index(inplace=False, ascending=False) \
-            .groupby(groupby_column)[new_column_name] \
-            .cummax() \
-            .rename("Cummax Right") \
-            .sort_index(inplace=False, ascending=True)
-
-    df_max_corrected = pd.concat([cummax_left, cummax_right], axis=1).min(axis=1)
-    df_max_by_time[new_column_name] = df_max_corrected
-
-    return df_max_by_time
-
-
 def main():
     run_app(app)
 
@@ -0,0 +1,87 @@
+# Load test of the app's database connections: 50 Shiny sessions starting at the same time, each running the
+# startup query of the Calendar page, with an engine per session (the former server()) or the shared engine of
+# data_access. Reports the session startup latency and the number of connections the database sees.
+# Needs the database of the config.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_app_sessions [--sessions 50]
+
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+import data_access
+from database import create_db_engine
+
+
+def count_connections(engine):
+    with engine.connect() as connection:
+        return connection.execute(text(
+            "select count(*) from pg_stat_activity where datname = current_database() and pid <> pg_backend_pid()"
+        )).scalar()
+
+
+def per_session_engine(config):
+    username = config["db_user"]
+    password = config["db_pwd"]
+    db_name = config["db_name"]
+    host_name = config["host_name"]
+    port = config["port"]
+
+    return create_engine(f"postgresql+psycopg2://{username}:{password}@{host_name}:{port}/{db_name}")
+
+
+def run_sessions(sessions, engine_for_session):
+    '''
+    Start the sessions concurrently. The engines stay referenced until all sessions started, like open browser tabs.
+        Returns:
+            The startup latencies in ms, and the engines of the sessions
+    '''
+    barrier = threading.Barrier(sessions)
+
+    def session(i):
+        barrier.wait()
+        start = perf_counter()
+        engine = engine_for_session()
+        data_access.read_rollup(engine, "Day")
+        return (perf_counter() - start) * 1000, engine
+
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(session, range(sessions)))
+
+    return [latency for latency, _ in results], [engine for _, engine in results]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    args = parser.parse_args()
+
+    config = data_access.app_config()
+    monitor = create_db_engine(config, pool_size=1, max_overflow=0)
+    baseline = count_connections(monitor)
+
+    modes = {
+        "engine per session": lambda: per_session_engine(config),
+        "shared engine": data_access.app_engine
+    }
+
+    print(f"{args.sessions} concurrent sessions, {baseline} other connections before the test")
+    print(f"{'mode':<20} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'connections':>12}")
+    for mode, engine_for_session in modes.items():
+        latencies, engines = run_sessions(args.sessions, engine_for_session)
+        connections = count_connections(monitor) - baseline
+        print(f"{mode:<20} {np.percentile(latencies, 50):8.1f} {np.percentile(latencies, 95):8.1f} "
+              f"{max(latencies):8.1f} {connections:12}")
+
+        for engine in set(engines):
+            engine.dispose()
+        data_access.shared.pop("engine", None)
+
+
+if __name__ == "__main__":
+    main()
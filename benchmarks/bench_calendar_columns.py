@@ -0,0 +1,107 @@
+# Benchmark the derivation of the calendar columns of the app on years of 15 minute intervals, comparing the per row
+# apply and Python date objects of the former load_data to data_access.add_calendar_columns.
+# Reports the time of the stage and the memory of the frame, and the time of a group by time of day (the envelopes,
+# the Stats page) on the former Time of Day datetimes and on the Slot integers.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_calendar_columns [--years 5] [--systems 2]
+
+import argparse
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import constants as co
+import data_access
+
+REPEAT = 3
+
+
+def energy_frame(years, systems):
+    '''
+        Returns:
+            A frame like data_access.read_energy, with random metrics
+    '''
+    rng = np.random.default_rng(0)
+    time = pd.date_range(datetime.combine(date.today(), datetime.min.time()) - timedelta(days=365 * years),
+                         periods=365 * years * 96, freq="15min")
+    metrics = [column for column in co.energy_column_mapping.values() if column not in ["System Id", "Time"]]
+
+    return pd.concat([
+        pd.DataFrame({"System Id": system_id, "Time": time,
+                      **{metric: rng.uniform(0, 1000, len(time)) for metric in metrics}})
+        for system_id in range(systems)
+    ], ignore_index=True)
+
+
+def row_wise_path(df_all):
+    # the former load_data, with "h" for the hour frequency pandas no longer accepts as "H"
+    today = date.today()
+    df_all["Time of Day"] = df_all["Time"].apply(lambda x: datetime.combine(today, x.time()))
+    df_all["Hour"] = df_all["Time"].dt.floor("h")
+    df_all["Day"] = df_all["Time"].dt.date
+    df_all["Day of Week"] = df_all["Time"].dt.dayofweek
+    df_all["Day of Month"] = df_all["Time"].dt.day
+    df_all["Month"] = df_all["Time"].dt.month
+    df_all["Month Name"] = df_all["Time"].dt.month_name()
+    df_all["Week"] = df_all["Time"].dt.day_of_year.apply(lambda x: x // 7)
+    df_all["Year"] = df_all["Time"].dt.year
+
+    return df_all
+
+
+def run(function, df):
+    '''
+        Returns:
+            The best time in ms, the memory of the resulting frame and of its calendar columns in MB
+    '''
+    timings = []
+    for i in range(REPEAT):
+        df_copy = df.copy()
+        start = perf_counter()
+        result = function(df_copy)
+        timings.append(perf_counter() - start)
+
+    memory = result.memory_usage(deep=True, index=False)
+
+    return min(timings) * 1000, memory.sum() / 2 ** 20, memory.drop(df.columns).sum() / 2 ** 20, result
+
+
+def group_time(df, keys):
+    '''
+        Returns:
+            The best time in ms of the maximum production per keys
+    '''
+    timings = []
+    for i in range(REPEAT):
+        start = perf_counter()
+        df.groupby(keys)["Produced"].max()
+        timings.append(perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the calendar columns of the app")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--systems", type=int, default=2)
+    args = parser.parse_args()
+
+    df = energy_frame(args.years, args.systems)
+    print(f"{len(df)} intervals ({args.years} years, {args.systems} systems)")
+
+    results = {}
+    for name, function in [("row wise", row_wise_path), ("vectorized", data_access.add_calendar_columns)]:
+        elapsed, memory, calendar_memory, results[name] = run(function, df)
+        print(f"{name:<12} {elapsed:9.1f} ms   frame {memory:7.1f} MB   calendar columns {calendar_memory:7.1f} MB")
+
+    for keys in [["Time of Day"], ["Month", "Time of Day"]]:
+        row_wise = group_time(results["row wise"], keys)
+        slots = group_time(results["vectorized"], [key if key != "Time of Day" else "Slot" for key in keys])
+        print(f"group by {', '.join(keys):<20} Time of Day {row_wise:7.1f} ms   Slot {slots:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
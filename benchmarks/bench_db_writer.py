@@ -0,0 +1,63 @@
+# Benchmark the write backends of db_writer on a backfill of production_meter rows, against the PostgreSQL
+# database of the config. The rows are written into a scratch table that is dropped afterwards.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_db_writer [--rows 1000000]
+
+import argparse
+import json
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import db_writer
+from database import create_db_engine
+
+TABLE = "bench_production_meter"
+
+
+def synthetic_frame(rows, system_id=1):
+    end_at = pd.date_range("2015-01-01 00:15", periods=rows, freq="15min", name="end_at")
+    rng = np.random.default_rng(0)
+
+    return pd.DataFrame({
+        "system_id": system_id,
+        "devices_reporting": rng.integers(0, 13, rows),
+        "wh_del": rng.integers(0, 1200, rows)
+    }, index=end_at)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with open('config/enlighten_v4_config.json') as config_file:
+        config = json.load(config_file)
+
+    pcon = create_db_engine(config)
+    df = synthetic_frame(args.rows)
+    print(f"{args.rows} rows")
+
+    for backend in db_writer.backends:
+        with pcon.begin() as connection:
+            connection.execute(text(f"drop table if exists {TABLE}"))
+            connection.execute(text(f"create table {TABLE} (like production_meter including all)"))
+
+        start = perf_counter()
+        db_writer.write_frame(pcon, df, TABLE, backend=backend)
+        elapsed = perf_counter() - start
+
+        with pcon.connect() as connection:
+            count = connection.execute(text(f"select count(*) from {TABLE}")).scalar()
+
+        print(f"{backend:<8} {elapsed:8.2f} s   {count / elapsed:10.0f} rows/s   ({count} rows written)")
+
+    with pcon.begin() as connection:
+        connection.execute(text(f"drop table if exists {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Benchmark the envelopes of the app on years of 15 minute intervals, comparing the pandas groupby and grouped cummax
+# of the former calculate_maximum (three times: global, month and week) to envelope_engine.EnvelopeEngine, for a
+# full computation and for the update with a day of new intervals.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_envelopes [--years 5] [--systems 2]
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import data_access
+from benchmarks.bench_calendar_columns import energy_frame
+from envelope_engine import EnvelopeEngine
+
+REPEAT = 3
+
+envelopes = {
+    "Max Produced (Global)": None,
+    "Max Produced (Month)": "Month",
+    "Max Produced (Week)": "Week"
+}
+
+
+def calculate_maximum(df, column_name, new_column_name="Max Produced", groupby_column=None):
+    # the former calculate_maximum of app.py
+    if groupby_column is None:
+        df_max_by_time = df \
+            .groupby("Slot")[column_name] \
+            .max() \
+            .reset_index() \
+            .rename(columns={column_name: new_column_name})
+
+        cummax_left = df_max_by_time[new_column_name].cummax()
+        cummax_right = df_max_by_time[new_column_name] \
+            .sort_index(inplace=False, ascending=False) \
+            .cummax()
+
+    else:
+        df_max_by_time = df \
+            .groupby([groupby_column, "Slot"])[column_name] \
+            .max() \
+            .reset_index() \
+            .rename(columns={column_name: new_column_name})
+
+        cummax_left = df_max_by_time \
+            .groupby(groupby_column)[new_column_name] \
+            .cummax() \
+            .rename("Cummax Left")
+        cummax_right = df_max_by_time \
+            .sort_index(inplace=False, ascending=False) \
+            .groupby(groupby_column)[new_column_name] \
+            .cummax() \
+            .rename("Cummax Right") \
+            .sort_index(inplace=False, ascending=True)
+
+    df_max_corrected = pd.concat([cummax_left, cummax_right], axis=1).min(axis=1)
+    df_max_by_time[new_column_name] = df_max_corrected
+
+    return df_max_by_time
+
+
+def pandas_path(df):
+    return {name: calculate_maximum(df, "Produced", name, group) for name, group in envelopes.items()}
+
+
+def engine_path(df):
+    engine = EnvelopeEngine(envelopes)
+    engine.update(df)
+
+    return engine
+
+
+def best_of(function, *args):
+    timings = []
+    for i in range(REPEAT):
+        start = perf_counter()
+        result = function(*args)
+        timings.append(perf_counter() - start)
+
+    return min(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the envelopes of the app")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--systems", type=int, default=2)
+    args = parser.parse_args()
+
+    df = data_access.add_calendar_columns(energy_frame(args.years, args.systems))
+    last_day = df["Day"] == df["Day"].max()
+    df_old, df_new = df[~last_day], df[last_day]
+    print(f"{len(df)} intervals ({args.years} years, {args.systems} systems)")
+
+    pandas_full, maxima = best_of(pandas_path, df)
+    engine_full, engine = best_of(engine_path, df)
+    print(f"full        calculate_maximum {pandas_full:8.1f} ms   engine {engine_full:7.1f} ms   "
+          f"speedup {pandas_full / engine_full:5.1f}x")
+
+    # a day of new intervals: the former app recomputed the envelopes of all groups
+    previous = engine_path(df_old)
+    pandas_update, _ = best_of(pandas_path, df)
+    engine_update, _ = best_of(lambda: previous.copy().update(df_new))
+    print(f"new day     calculate_maximum {pandas_update:8.1f} ms   engine {engine_update:7.1f} ms   "
+          f"speedup {pandas_update / engine_update:5.1f}x")
+
+    for name, group in envelopes.items():
+        keys = ["Slot"] if group is None else [group, "Slot"]
+        expected = maxima[name].set_index(keys)[name]
+        index = pd.DataFrame({key: expected.index.get_level_values(key) for key in keys})
+        assert np.allclose(engine.lookup(name, index), expected.to_numpy(), equal_nan=True), name
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Benchmark the per call latency of the Enlighten API client against the local fake Enphase API,
+# comparing bare requests.get calls (one connection per call) with the pooled session of enlightenAPI_v4.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_http_session
+
+import io
+from contextlib import redirect_stdout
+from statistics import mean, median
+from time import perf_counter
+
+import requests
+
+from enlighten import enlightenAPI_v4
+from fake_enphase import FakeEnphaseServer
+
+N_CALLS = 200
+
+
+def time_calls(call, n=N_CALLS):
+    timings = []
+    # the client prints every url it calls, keep that out of the timings
+    with redirect_stdout(io.StringIO()):
+        for i in range(n):
+            start = perf_counter()
+            call()
+            timings.append((perf_counter() - start) * 1000)
+
+    return timings
+
+
+def report(name, timings):
+    print(f"{name:<20} mean {mean(timings):7.3f} ms   median {median(timings):7.3f} ms   total {sum(timings):8.1f} ms")
+
+
+def main():
+    server = FakeEnphaseServer().start()
+    api = enlightenAPI_v4(server.client_config())
+    system_id = server.data.system_ids[0]
+    url = f"{server.api_url}api/v4/systems/{system_id}/summary?key=fake"
+
+    bare = time_calls(lambda: requests.get(url, headers={"Authorization": "Bearer fake"}))
+    pooled = time_calls(lambda: api.load_monitoring_data(system_id, "summary"))
+
+    print(f"{N_CALLS} calls against {server.api_url}")
+    report("requests.get", bare)
+    report("pooled session", pooled)
+
+    api.close()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Benchmark the ingest throughput of enlightenAPI_v4.telemetry() against the local fake Enphase API,
+# loading the same backfill sequentially and with a growing number of concurrent windows.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_ingest [--days 50] [--latency 100]
+
+import argparse
+import io
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from enlighten import enlightenAPI_v4
+from fake_enphase import FakeEnphaseServer
+
+
+def run(api, system_id, telemetry_type, start_at, workers):
+    start = perf_counter()
+    with redirect_stdout(io.StringIO()):
+        df = api.telemetry(system_id,
+                           telemetry_type=telemetry_type,
+                           start_at=start_at,
+                           granularity="week",
+                           as_type="dataframe",
+                           parallel=workers > 1,
+                           max_workers=workers)
+
+    return perf_counter() - start, len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=100, help="latency of the fake API, in ms")
+    parser.add_argument("--type", default="production_meter")
+    args = parser.parse_args()
+
+    with FakeEnphaseServer(latency_ms=args.latency, history_days=args.days) as server:
+        api = enlightenAPI_v4(server.client_config())
+        system_id = server.data.system_ids[0]
+        start_at = datetime.now() - timedelta(days=args.days)
+
+        print(f"{args.type}: {args.days} days backfill, {args.latency:.0f} ms latency")
+        baseline = None
+        for workers in [1, 2, 4, 8]:
+            elapsed, rows = run(api, system_id, args.type, start_at, workers)
+            baseline = baseline or elapsed
+            print(f"workers {workers}: {elapsed:6.2f} s   {rows / elapsed:9.0f} rows/s   speedup {baseline / elapsed:4.1f}x")
+
+        api.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Compare reading the app's energy data from PostgreSQL (the energy_wide view) with the Parquet archive, on the data
+# of the database of the config. The archive is first exported to a temporary directory, which is removed afterwards.
+# Needs pyarrow.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_parquet_archive [--repeat 3]
+
+import argparse
+import json
+import shutil
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+
+import data_access
+import parquet_archive
+from database import create_db_engine
+
+
+def timed(function, repeat):
+    '''
+        Returns:
+            The best time in ms of repeat calls, and the result of the last call
+    '''
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        elapsed = (perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open('config/enlighten_v4_config.json') as config_file:
+        config = json.load(config_file)
+
+    pcon = create_db_engine(config)
+    directory = tempfile.mkdtemp(prefix="enphase_archive_")
+    try:
+        archive = parquet_archive.ParquetArchive(directory)
+        parquet_archive.export_database(pcon, archive)
+
+        with pcon.connect() as connection:
+            last = pd.read_sql("select max(end_at) as last from energy_wide", connection)["last"][0]
+        month_start = last - pd.Timedelta(days=30)
+
+        cases = {
+            "full history": (
+                lambda: data_access.read_energy(pcon),
+                lambda: archive.read_energy()
+            ),
+            "last 30 days": (
+                lambda: pd.read_sql("select * from energy_wide where end_at > %(start)s", pcon,
+                                    params={"start": month_start.to_pydatetime()}),
+                lambda: archive.read_energy(start=month_start)
+            ),
+            "production, 2 columns": (
+                lambda: pd.read_sql("select end_at, wh_del from production_meter", pcon),
+                lambda: archive.read("production_meter", ["Time", "Produced"])
+            )
+        }
+
+        print(f"{'case':<24} {'postgres ms':>12} {'parquet ms':>12} {'rows':>10} {'speedup':>8}")
+        for name, (read_postgres, read_parquet) in cases.items():
+            postgres_ms, df_postgres = timed(read_postgres, args.repeat)
+            parquet_ms, df_parquet = timed(read_parquet, args.repeat)
+            if len(df_postgres) != len(df_parquet):
+                print(f"{name}: {len(df_postgres)} rows from postgres, {len(df_parquet)} from parquet")
+            print(f"{name:<24} {postgres_ms:12.1f} {parquet_ms:12.1f} {len(df_parquet):10} {postgres_ms / parquet_ms:7.1f}x")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
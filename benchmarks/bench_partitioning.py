@@ -0,0 +1,103 @@
+# Compare query plans of the plain telemetry tables with the partitioned schema mode (sql/create_db_partitioned.sql)
+# on years of 15 minute production_meter data, against the PostgreSQL database of the config.
+# The ensure_monthly_partition functions of create_db_partitioned.sql must exist. Scratch tables are dropped afterwards.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_partitioning [--years 5.5] [--systems 3]
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import db_writer
+from database import create_db_engine
+
+COLUMNS = """
+    system_id           bigint not null,
+    end_at              timestamp not null,
+    devices_reporting   bigint,
+    wh_del              bigint
+"""
+
+layouts = {
+    "bench_heap": f"create table bench_heap ({COLUMNS})",
+    "bench_heap_pk": f"create table bench_heap_pk ({COLUMNS}, primary key (system_id, end_at))",
+    "bench_partitioned": f"create table bench_partitioned ({COLUMNS}, primary key (system_id, end_at)) partition by range (end_at)"
+}
+
+
+def synthetic_frame(years, system_ids):
+    end_at = pd.date_range("2018-01-01 00:15", periods=int(years * 365 * 96), freq="15min")
+    rng = np.random.default_rng(0)
+
+    frames = [pd.DataFrame({
+        "system_id": system_id,
+        "end_at": end_at,
+        "devices_reporting": rng.integers(0, 13, len(end_at)),
+        "wh_del": rng.integers(0, 1200, len(end_at))
+    }) for system_id in system_ids]
+
+    # rows arrive in end_at order, as the loader appends them
+    return pd.concat(frames).sort_values(["end_at", "system_id"]).set_index("end_at")
+
+
+def explain(connection, query, params):
+    plan = connection.execute(text(f"explain (analyze, buffers, format json) {query}"), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]
+
+    return root["Execution Time"], root["Plan"].get("Shared Hit Blocks", 0) + root["Plan"].get("Shared Read Blocks", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=float, default=5.5)
+    parser.add_argument("--systems", type=int, default=3)
+    args = parser.parse_args()
+
+    with open('config/enlighten_v4_config.json') as config_file:
+        config = json.load(config_file)
+
+    pcon = create_db_engine(config)
+    system_ids = list(range(1, args.systems + 1))
+    df = synthetic_frame(args.years, system_ids)
+    last = df.index.max()
+    print(f"{len(df)} rows, {args.systems} systems, {args.years} years")
+
+    for table, ddl in layouts.items():
+        with pcon.begin() as connection:
+            connection.execute(text(f"drop table if exists {table}"))
+            connection.execute(text(ddl))
+        db_writer.write_frame(pcon, df, table, backend="copy", partitioned=table == "bench_partitioned")
+        with pcon.begin() as connection:
+            connection.execute(text(f"analyze {table}"))
+
+    queries = {
+        "watermark": ("select max(end_at) from {table} where system_id = :system_id",
+                      {"system_id": system_ids[-1]}),
+        "last month, all systems": ("select * from {table} where end_at > :start_at and end_at <= :end_at",
+                                    {"start_at": last - pd.Timedelta(days=30), "end_at": last}),
+        "last week, one system": ("select * from {table} where system_id = :system_id and end_at > :start_at and end_at <= :end_at",
+                                  {"system_id": system_ids[0], "start_at": last - pd.Timedelta(days=7), "end_at": last}),
+    }
+
+    print(f"{'query':<26} {'table':<20} {'ms':>10} {'buffers':>10}")
+    with pcon.connect() as connection:
+        for name, (query, params) in queries.items():
+            for table in layouts:
+                # run twice, report the warm run
+                explain(connection, query.format(table=table), params)
+                ms, buffers = explain(connection, query.format(table=table), params)
+                print(f"{name:<26} {table:<20} {ms:10.2f} {buffers:10}")
+
+    with pcon.begin() as connection:
+        for table in layouts:
+            connection.execute(text(f"drop table if exists {table}"))
+
+
+if __name__ == "__main__":
+    main()
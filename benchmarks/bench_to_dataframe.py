@@ -0,0 +1,56 @@
+# Benchmark the conversion of telemetry intervals to a dataframe on a year of 15 minute intervals,
+# comparing json_normalize with per row timestamp conversion (the former __to_dataframe) to the columnar path.
+#
+# Run from the repository root:
+#     python -m benchmarks.bench_to_dataframe
+
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import pandas as pd
+
+from enlighten import records_to_dataframe
+from fake_enphase import FakeEnphaseData
+
+REPEAT = 3
+
+
+def json_normalize_path(result):
+    df = pd.json_normalize(result, record_path=["intervals"], meta=["system_id"])
+    df["end_at"] = df["end_at"].apply(lambda x: datetime.fromtimestamp(x))
+
+    return df
+
+
+def columnar_path(result):
+    return records_to_dataframe(result["intervals"],
+                                meta={"system_id": result["system_id"]},
+                                timestamp_columns=["end_at"])
+
+
+def best_of(function, result):
+    timings = []
+    for i in range(REPEAT):
+        start = perf_counter()
+        function(result)
+        timings.append(perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+def main():
+    data = FakeEnphaseData()
+    end_at = int(datetime.now().timestamp())
+    start_at = int((datetime.now() - timedelta(days=365)).timestamp())
+
+    for kind in ["production_meter", "battery"]:
+        result = data.telemetry(data.system_ids[0], kind, start_at, end_at, "week")
+        normalized = best_of(json_normalize_path, result)
+        columnar = best_of(columnar_path, result)
+
+        print(f"{kind:<18} {len(result['intervals'])} intervals   "
+              f"json_normalize {normalized:8.1f} ms   columnar {columnar:7.1f} ms   speedup {normalized / columnar:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
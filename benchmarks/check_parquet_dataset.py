@@ -0,0 +1,112 @@
+# Check that the app loads its shared dataset from the Parquet archive ("app_storage": "parquet"), without a database:
+# the archive is filled from the local fake Enphase API in a temporary directory, then the watermark polling,
+# energy_dataset.load_dataset, the older history reads of the pages and the envelope lookups run against it and are
+# compared with the archive.
+# Needs pyarrow.
+#
+# Run from the repository root:
+#     python -m benchmarks.check_parquet_dataset [--days 120] [--systems 2]
+
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import data_access
+import energy_dataset
+import parquet_archive
+from enlighten import enlightenAPI_v4
+from fake_enphase import FakeEnphaseServer
+
+
+def fill_archive(archive, days, systems):
+    '''
+    Write the telemetry of the app of the fake API systems, from days ago up to now, into the archive, with their
+    watermarks like the loader
+    '''
+    server = FakeEnphaseServer(systems=systems, history_days=days).start()
+    api = enlightenAPI_v4(server.client_config())
+    start_at = datetime.now() - timedelta(days=days)
+
+    try:
+        for system_id in server.data.system_ids:
+            for type in parquet_archive.type_mapping:
+                # the client prints every url it calls
+                with redirect_stdout(io.StringIO()):
+                    df = api.telemetry(system_id, type, start_at=start_at, granularity="week", as_type="dataframe")
+                archive.write_frame(df, type)
+                archive.write_watermark(system_id, type, datetime.combine(datetime.now().date(), datetime.min.time()),
+                                        df.index.max())
+    finally:
+        api.close()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the shared dataset of the app from a Parquet archive")
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--systems", type=int, default=2)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="enphase_archive_")
+    try:
+        archive = parquet_archive.ParquetArchive(os.path.join(directory, "archive"))
+        fill_archive(archive, args.days, args.systems)
+
+        config_file = os.path.join(directory, "config.json")
+        with open(config_file, "w") as f:
+            json.dump({"app_storage": "parquet", "archive_directory": archive.directory, "app_history_days": 35}, f)
+        data_access.config_file = config_file
+
+        # the watermarks the app polls, from the archive
+        watermark = data_access.read_ingest_watermark(*energy_dataset.storage())
+        assert len(watermark) == args.systems * len(parquet_archive.type_mapping)
+
+        snapshot, complete = energy_dataset.load_dataset(watermark)
+        data = snapshot["data"]
+        print(f"snapshot: {len(data)} intervals from {snapshot['start']}, extent {snapshot['extent']}")
+        assert complete and not data.empty
+
+        # the same watermark again: only the intervals after complete_until are re-read
+        appended, complete = energy_dataset.load_dataset(watermark, snapshot)
+        assert complete and len(appended["data"]) == len(data)
+
+        # the whole history, the snapshot followed by the older months read from the archive
+        expected = energy_dataset.load_energy_data(None, archive)
+        history = energy_dataset.energy_range(snapshot)
+        history = history.sort_values(["System Id", "Time"], ignore_index=True)
+        pd.testing.assert_frame_equal(history, expected[history.columns])
+        print(f"history: {len(history)} intervals, {len(snapshot['history'])} months cached")
+
+        # a day of older history reads its month only, and the months of the cache are kept least recently used
+        day = snapshot["start"] - timedelta(days=20)
+        snapshot["history"].clear()
+        energy_dataset.energy_range(snapshot, day, day + timedelta(days=1), columns=["Produced"])
+        assert [key[0] for key in snapshot["history"]] == [day.to_period("M")]
+        first = energy_dataset.energy_range(snapshot)
+        energy_dataset.energy_range(snapshot, day, day + timedelta(days=1), columns=["Produced"])
+        assert list(snapshot["history"])[-1][0] == day.to_period("M")
+        assert len(first) == len(history)
+
+        displayed = energy_dataset.with_envelopes(energy_dataset.energy_range(snapshot, day, day + timedelta(days=1)),
+                                                  snapshot["envelopes"])
+        produced = displayed[displayed["Produced"] > 0]
+        assert not produced.empty and produced["Max Produced (Global)"].ge(produced["Produced"]).all()
+
+        for granularity, df in snapshot["rollups"].items():
+            assert abs(df["Produced"].sum() - expected["Produced"].sum()) < 1e-3 * expected["Produced"].sum()
+            print(f"rollup {granularity}: {len(df)} periods")
+
+        print("ok")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,23 @@ column_mapping = {
     }
 }
 
+rollup_column_mapping = {
+    "system_id": "System Id",
+    "produced": "Produced",
+    "consumed": "Consumed",
+    "imported": "Imported",
+    "exported": "Exported",
+    "charged": "Charged",
+    "discharged": "Discharged"
+}
+
+# columns of the energy_wide view (sql/create_db.sql)
+energy_column_mapping = {
+    **rollup_column_mapping,
+    "end_at": "Time",
+    "soc_percent": "Charged (Pct)"
+}
+
 colors = {
     "Produced": "deepskyblue",
     "Consumed": "orangered",
@@ -0,0 +1,323 @@
+# Data access for the app: reads the energy data from the database, in the column names and types the pages use.
+# The config, the engine and its connection pool are created once per process and shared by all Shiny sessions.
+
+import json
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+import constants as co
+import energy_view
+import rollups
+from database import create_db_engine, configure_logging
+
+config_file = 'config/enlighten_v4_config.json'
+
+# the intervals of a day: the Slot column numbers them by end time, from 0 (00:00) to 95 (23:45). The pages group
+# and filter on it, and only turn it into times of day to plot it (slot_labels)
+slot_length = pd.Timedelta(minutes=15)
+
+month_names = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+               "November", "December"]
+
+shared = {}
+shared_lock = threading.Lock()
+
+
+def app_config():
+    '''
+        Returns:
+            The application config, read once per process
+    '''
+    with shared_lock:
+        if "config" not in shared:
+            with open(config_file) as f:
+                shared["config"] = json.load(f)
+            configure_logging(shared["config"])
+
+        return shared["config"]
+
+
+def app_engine():
+    '''
+    The engine of the app, shared by all sessions. The pool is sized for the queries running at the same time, not
+    for the number of sessions: size it with app_pool in the config (pool_size, max_overflow, pool_recycle,
+    pool_timeout). Statements are logged with "sql_log_level": "INFO".
+        Returns:
+            The SQLAlchemy engine
+    '''
+    config = app_config()
+
+    with shared_lock:
+        if "engine" not in shared:
+            shared["engine"] = create_db_engine(config, **config.get("app_pool", {}))
+
+        return shared["engine"]
+
+
+def app_archive():
+    '''
+        Returns:
+            The Parquet archive the app reads its telemetry from with "app_storage": "parquet", None otherwise
+    '''
+    config = app_config()
+    if config.get("app_storage", "postgres") != "parquet":
+        return None
+
+    with shared_lock:
+        if "archive" not in shared:
+            # pyarrow is only needed with an archive
+            import parquet_archive
+            shared["archive"] = parquet_archive.ParquetArchive(config.get("archive_directory", "data/archive"))
+
+        return shared["archive"]
+
+
+def read_ingest_watermark(pcon, archive=None):
+    '''
+    Read the ingest watermarks (see watermarks.py), which move whenever the loader writes telemetry
+        Parameters:
+            archive: a parquet_archive.ParquetArchive to read the copy of the watermarks from instead of the database
+        Returns:
+            A tuple of (system_id, telemetry_type, complete_until, last_end_at) tuples
+    '''
+    if archive is not None:
+        return archive.read_watermark()
+
+    with pcon.connect() as connection:
+        rows = connection.execute(text("""
+            select system_id, telemetry_type, complete_until, last_end_at
+            from ingest_watermark
+            order by system_id, telemetry_type
+        """)).fetchall()
+
+    return tuple(tuple(row) for row in rows)
+
+
+def read_energy(pcon, archive=None, after=None, until=None, system_id=None, columns=None):
+    '''
+    Read the energy_wide view, joined and signed by the database (see energy_view.py). The time range, system and
+    columns are part of the query, only the requested data leaves the database.
+        Parameters:
+            archive: a parquet_archive.ParquetArchive to read instead of the database
+            after: only read the intervals ending after this time
+            until: only read the intervals ending up to this time (included)
+            system_id: only read this system
+            columns: the metrics to read (e.g. ["Produced"]), all by default. System Id and Time are always read.
+        Returns:
+            A dataframe with the System Id, Time, the six metrics and the battery state of charge, or the requested
+            metrics
+    '''
+    if archive is not None:
+        df = archive.read_energy(system_id=system_id, start=after, end=until, columns=columns)
+        return df if columns is None else df[["System Id", "Time"] + list(columns)]
+
+    names = {name: column for column, name in co.energy_column_mapping.items()}
+    select = "*" if columns is None else ", ".join(["system_id", "end_at"] + [names[column] for column in columns])
+
+    conditions, params = [], {}
+    if after is not None:
+        conditions.append("end_at > %(after)s")
+        params["after"] = pd.Timestamp(after).to_pydatetime()
+    if until is not None:
+        conditions.append("end_at <= %(until)s")
+        params["until"] = pd.Timestamp(until).to_pydatetime()
+    if system_id is not None:
+        conditions.append("system_id = %(system_id)s")
+        params["system_id"] = int(system_id)
+
+    query = f"select {select} from {energy_view.view_name}"
+    if conditions:
+        query += " where " + " and ".join(conditions)
+
+    return pd.read_sql(query + " order by system_id, end_at", pcon, params=params) \
+        .rename(columns=co.energy_column_mapping)
+
+
+def add_calendar_columns(df):
+    '''
+    Derive the calendar columns of the pages from Time, vectorized and in compact types: the metrics as float32, the
+    time of day as the int16 Slot, the calendar numbers as small integers, Day as datetime64 and Month Name as a
+    category. Modifies df.
+        Returns:
+            df
+    '''
+    time = df["Time"]
+    metrics = [column for column in co.energy_column_mapping.values()
+               if column in df.columns and column not in ["System Id", "Time"]]
+    df[metrics] = df[metrics].astype("float32")
+
+    day = time.dt.normalize()
+    df["Slot"] = ((time - day) // slot_length).astype("int16")
+    df["Hour"] = time.dt.floor("h")
+    df["Day"] = day
+    df["Day of Week"] = time.dt.dayofweek.astype("int8")
+    df["Day of Month"] = time.dt.day.astype("int8")
+    df["Month"] = time.dt.month.astype("int8")
+    df["Month Name"] = pd.Categorical.from_codes(df["Month"] - 1, month_names)
+    df["Week"] = (time.dt.day_of_year // 7).astype("int8")
+    df["Year"] = time.dt.year.astype("int16")
+
+    return df
+
+
+def slot_labels(slots):
+    '''
+    The display labels of slots. Plotly doesn't accept times, so times of day are plotted as datetimes of today.
+        Returns:
+            The datetimes of today at the slots, like slots (a Series or an array)
+    '''
+    return pd.Timestamp.today().normalize() + slots * slot_length
+
+
+def label_slots(labels):
+    '''
+        Returns:
+            The slots of the labels returned by slot_labels, e.g. clicked on a plot
+    '''
+    labels = pd.to_datetime(pd.Series(labels))
+
+    return ((labels - labels.dt.normalize()) // slot_length).astype("int16").tolist()
+
+
+def read_time_extent(pcon, archive=None):
+    '''
+        Returns:
+            The first and last Time of the energy data, None when there is no data
+    '''
+    if archive is not None:
+        df = archive.read("import", ["Time"])
+        return (None, None) if df.empty else (df["Time"].min(), df["Time"].max())
+
+    with pcon.connect() as connection:
+        first, last = connection.execute(text(f"select min(end_at), max(end_at) from {energy_view.view_name}")).first()
+
+    return first, last
+
+
+def read_production_peaks(pcon, archive=None, until=None, excluded_days=()):
+    '''
+    Aggregate the maximum production per Month, Week (day of year // 7) and Slot, in the database
+        Parameters:
+            until: only aggregate the intervals ending up to this time (included)
+            excluded_days: the days to leave out
+        Returns:
+            A dataframe with the Month, Week, Slot and Produced columns
+    '''
+    if archive is not None:
+        df = archive.read("production_meter", ["Time", "Produced"], end=until)
+        df = df[~df["Time"].dt.date.isin(excluded_days)]
+        return df.groupby([df["Time"].dt.month.rename("Month"),
+                           (df["Time"].dt.day_of_year // 7).rename("Week"),
+                           ((df["Time"] - df["Time"].dt.normalize()) // slot_length).rename("Slot")])["Produced"] \
+            .max() \
+            .reset_index()
+
+    conditions, params = ["produced is not null"], {}
+    if until is not None:
+        conditions.append("end_at <= %(until)s")
+        params["until"] = pd.Timestamp(until).to_pydatetime()
+    if excluded_days:
+        conditions.append("cast(end_at as date) not in %(excluded_days)s")
+        params["excluded_days"] = tuple(excluded_days)
+
+    return pd.read_sql(f"""
+        select cast(extract(month from end_at) as integer) as "Month",
+               cast(extract(doy from end_at) as integer) / 7 as "Week",
+               cast(extract(hour from end_at) * 4 + floor(extract(minute from end_at) / 15) as integer) as "Slot",
+               max(produced) as "Produced"
+        from {energy_view.view_name}
+        where {" and ".join(conditions)}
+        group by 1, 2, 3
+    """, pcon, params=params)
+
+
+def period_start(time, granularity):
+    '''
+        Returns:
+            The start of the Hour, Day or Month holding time
+    '''
+    time = pd.Timestamp(time)
+    if granularity == "Month":
+        return time.to_period("M").to_timestamp()
+
+    return time.floor("h" if granularity == "Hour" else "D")
+
+
+def read_rollup(pcon, granularity, since=None, archive=None):
+    '''
+    Read a rollup table (see rollups.py), aggregated by the loader per system and per Hour, Day or Month
+        Parameters:
+            since: only read the periods from the one holding this time
+            archive: a parquet_archive.ParquetArchive to aggregate instead of reading the database
+        Returns:
+            A dataframe with the System Id, the period in a column named after the granularity and the six metrics.
+            The Day rollup also has the calendar columns of the Calendar and Comparison pages.
+    '''
+    if archive is not None:
+        df = archive_rollup(archive, granularity, since)
+    else:
+        query = f"select * from {rollups.granularities[granularity]}"
+        params = {}
+        if since is not None:
+            query += " where period >= %(start)s"
+            params["start"] = period_start(since, granularity).to_pydatetime()
+
+        df = pd.read_sql(query + " order by period", pcon, params=params) \
+            .rename(columns=co.rollup_column_mapping) \
+            .rename(columns={"period": granularity})
+
+    if granularity == "Day":
+        day = df["Day"]
+        df["Day"] = day.dt.date
+        df["Month"] = day.dt.month
+        df["Month Name"] = day.dt.month_name()
+        df["Day of Week"] = day.dt.dayofweek
+        df["Day of Month"] = day.dt.day
+
+    return df
+
+
+def archive_rollup(archive, granularity, since=None):
+    '''
+    Aggregate the energy data of the archive like the loader aggregates the rollup tables: an interval belongs to the
+    period of its end time
+        Returns:
+            A dataframe like the rollup table, sorted on the period
+    '''
+    after = None if since is None else period_start(since, granularity) - pd.Timedelta(seconds=1)
+    metrics = list(co.rollup_column_mapping.values())[1:]
+    df = archive.read_energy(start=after, columns=metrics)
+
+    time = df["Time"]
+    period = time.dt.to_period("M").dt.to_timestamp() if granularity == "Month" \
+        else time.dt.floor("h" if granularity == "Hour" else "D")
+
+    return df.groupby(["System Id", period.rename(granularity)])[metrics] \
+        .sum(min_count=1) \
+        .reset_index() \
+        .sort_values(granularity, ignore_index=True)
+
+
+def read_rollups(pcon, since=None, archive=None):
+    '''
+        Returns:
+            A dictionary of granularity -> rollup dataframe, with the periods from the one holding since
+    '''
+    return {granularity: read_rollup(pcon, granularity, since, archive) for granularity in rollups.granularities}
+
+
+def update_rollups(previous, pcon, since, archive=None):
+    '''
+    Re-read the periods of the rollups from the one holding since, the loader may have updated them
+        Returns:
+            A new dictionary of granularity -> rollup dataframe, the previous periods followed by the re-read ones
+    '''
+    updated = {}
+    for granularity, df in read_rollups(pcon, since, archive).items():
+        old = previous[granularity]
+        old = old[pd.to_datetime(old[granularity]) < period_start(since, granularity)]
+        updated[granularity] = pd.concat([old, df], ignore_index=True)
+
+    return updated
@@ -0,0 +1,44 @@
+# Database connections for the loader and the app.
+
+import logging
+
+from sqlalchemy import create_engine
+
+
+def create_db_engine(config, pool_size=5, max_overflow=10, echo=False, pool_recycle=1800, pool_timeout=30):
+    '''
+    Create an engine for the PostgreSQL database described in the config
+        Parameters:
+            config: the application config, with db_user, db_pwd, db_name, host_name and port
+            pool_size: the number of connections kept open in the pool
+            max_overflow: the number of extra connections allowed when the pool is exhausted
+            pool_recycle: the age in seconds after which a pooled connection is replaced, before the server or a
+                          firewall drops it
+            pool_timeout: the number of seconds to wait for a connection when the pool is exhausted
+        Returns:
+            The SQLAlchemy engine
+    '''
+    username = config["db_user"]
+    password = config["db_pwd"]
+    db_name = config["db_name"]
+    host_name = config["host_name"]
+    port = config["port"]
+
+    return create_engine(f"postgresql+psycopg2://{username}:{password}@{host_name}:{port}/{db_name}",
+                         pool_size=pool_size,
+                         max_overflow=max_overflow,
+                         pool_pre_ping=True,
+                         pool_recycle=pool_recycle,
+                         pool_timeout=pool_timeout,
+                         echo=echo)
+
+
+def configure_logging(config):
+    '''
+    Configure the log levels of the config: log_level for the application, sql_log_level for SQLAlchemy, which logs
+    every statement at INFO level and the pool checkouts at DEBUG level
+    '''
+    logging.basicConfig(level=config.get("log_level", "WARNING"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("sqlalchemy.engine").setLevel(config.get("sql_log_level", "WARNING"))
+    logging.getLogger("sqlalchemy.pool").setLevel(config.get("sql_log_level", "WARNING"))
@@ -0,0 +1,141 @@
+# Bulk writes of telemetry dataframes into PostgreSQL.
+# The "copy" backend streams the frame through an in-memory CSV buffer into COPY FROM STDIN, which is an order of
+# magnitude faster than the row by row INSERTs of DataFrame.to_sql. The "to_sql" backend is kept as a fallback.
+# The "upsert" backend copies the frame into a staging table and merges it on the primary key (system_id, end_at),
+# so overlapping windows and re-runs of the loader never create duplicate rows.
+
+import io
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+backends = ("upsert", "copy", "to_sql")
+
+key_columns = ["system_id", "end_at"]
+
+
+def write_frame(pcon, df, table, backend="upsert", partitioned=False, batch_size=100000, connection=None):
+    '''
+    Write a dataframe to a table, its index included as a column (like DataFrame.to_sql)
+        Parameters:
+            backend: "upsert" to insert or update rows on the primary key, "copy" to append with COPY FROM STDIN,
+                     "to_sql" to append with DataFrame.to_sql
+            partitioned: True for the partitioned schema mode, the monthly partitions of the rows are created first,
+                         in the transaction of connection when given
+            batch_size: the number of rows per COPY statement, all batches are written in a single transaction
+            connection: a connection with an open transaction to write in, so the caller can commit other changes
+                        with the rows. By default the rows are written in a transaction of their own.
+        Returns:
+            The number of rows written
+    '''
+    if backend not in backends:
+        raise ValueError(f"Unknown write backend {backend}, expected one of {backends}")
+
+    if df.empty:
+        return 0
+
+    df = drop_duplicate_keys(df)
+
+    if partitioned:
+        ensure_partitions(pcon, table, df.index.get_level_values("end_at"), connection=connection)
+
+    if backend == "to_sql":
+        df.to_sql(table, pcon if connection is None else connection, if_exists="append")
+        return len(df)
+
+    df = to_copy_format(df.reset_index())
+
+    with pcon.begin() if connection is None else nullcontext(connection) as connection:
+        if backend == "copy":
+            copy_frame(connection, df, table, batch_size)
+        else:
+            stage = f"{table}_stage"
+            connection.exec_driver_sql(f'create temp table "{stage}" (like "{table}" including defaults) on commit drop')
+            copy_frame(connection, df, stage, batch_size)
+            connection.exec_driver_sql(upsert_statement(table, stage, list(df.columns)))
+
+    return len(df)
+
+
+def drop_duplicate_keys(df):
+    '''
+    On the autumn daylight saving time change, the API returns the intervals of the repeated hour twice with the same
+    naive local end_at. The append backends would write both, or fail on the primary key.
+        Returns:
+            The dataframe with the last row of each (system_id, end_at) key, like the upsert backend keeps
+    '''
+    keys = df.reset_index()
+    keys = keys[[column for column in key_columns if column in keys.columns]]
+    duplicated = keys.duplicated(keep="last").to_numpy()
+
+    return df[~duplicated] if duplicated.any() else df
+
+
+def ensure_partitions(pcon, table, end_at, connection=None):
+    '''
+    Create the monthly partitions (see sql/create_db_partitioned.sql) holding the given end_at values. Creating a
+    partition locks the parent table exclusively until the commit, so callers writing in a longer transaction create
+    the partitions first, in a transaction of their own; the partitions that already exist are not locked.
+        Parameters:
+            connection: a connection with an open transaction to create the partitions in, by default they are
+                        created in a transaction of their own
+    '''
+    months = sorted(set(pd.DatetimeIndex(end_at).to_period("M").to_timestamp()))
+
+    with pcon.begin() if connection is None else nullcontext(connection) as connection:
+        for month in months:
+            connection.execute(text("select ensure_monthly_partition(:parent, :month)"),
+                               {"parent": table, "month": month.date()})
+
+
+def copy_frame(connection, df, table, batch_size=100000):
+    columns = ", ".join(f'"{col}"' for col in df.columns)
+    copy_sql = f'copy "{table}" ({columns}) from stdin with (format csv, null \'\')'
+
+    cursor = connection.connection.cursor()
+    try:
+        for start in range(0, len(df), batch_size):
+            buffer = io.StringIO()
+            df.iloc[start:start + batch_size].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+
+
+def upsert_statement(table, stage, columns):
+    '''
+        Returns:
+            The statement merging the staging table into the table. When the staged frame holds the same key more
+            than once, the last row wins.
+    '''
+    column_list = ", ".join(f'"{col}"' for col in columns)
+    keys = ", ".join(f'"{col}"' for col in key_columns)
+    updates = ",\n            ".join(f'"{col}" = excluded."{col}"' for col in columns if col not in key_columns)
+
+    return f"""
+        insert into "{table}" ({column_list})
+        select distinct on ({keys}) {column_list}
+        from (select *, ctid as stage_order from "{stage}") staged
+        order by {keys}, stage_order desc
+        on conflict ({keys}) do {f"update set {updates}" if updates else "nothing"}
+    """
+
+
+def to_copy_format(df):
+    '''
+    Missing values turn integer columns into floats, which would be written as "12.0" and rejected by bigint columns.
+    Float columns holding only whole numbers are converted to nullable integers.
+        Returns:
+            The converted dataframe
+    '''
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_float_dtype(df[col]):
+            values = df[col].dropna().to_numpy()
+            if len(values) == 0 or np.all(np.mod(values, 1) == 0):
+                df[col] = df[col].astype("Int64")
+
+    return df
@@ -0,0 +1,261 @@
+# The shared dataset of the app (see shared_dataset.py): the snapshot of the energy data held in memory, its
+# production envelopes and rollups, and the reads of older history for the pages. Kept apart from app.py so it can be
+# loaded without Shiny.
+# The storage is the database, or the Parquet archive with "app_storage": "parquet" in the config.
+
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import pandas as pd
+
+import constants as co
+import data_access
+import energy_view
+from envelope_engine import EnvelopeEngine
+
+# the envelopes of the energy data: column name -> group column (None for the whole history)
+envelopes = {
+    "Max Produced (Global)": None,
+    "Max Produced (Month)": "Month",
+    "Max Produced (Week)": "Week"
+}
+
+# Remove dates from interventions. Outliers are possible for these dates
+intervention_dates = [date(2023,5,4),date(2023,5,17)]
+
+
+def storage():
+    '''
+        Returns:
+            The engine and the Parquet archive the app reads, see data_access.app_archive. With an archive, the
+            engine is None: the energy data and the rollups are read from the archive only.
+    '''
+    archive = data_access.app_archive()
+
+    return (data_access.app_engine() if archive is None else None), archive
+
+
+def load_energy_data(pcon, archive=None, after=None, until=None, system_id=None, columns=None):
+    df_all = data_access.read_energy(pcon, archive, after, until, system_id, columns)
+
+    return data_access.add_calendar_columns(df_all)
+
+
+def peak_rows(df):
+    '''
+        Returns:
+            The rows of df the envelopes are computed from, outliers are possible on the intervention dates. Only the
+            columns of the envelopes are copied.
+    '''
+    return df.loc[~df["Day"].isin(pd.to_datetime(intervention_dates)), ["Month", "Week", "Slot", "Produced"]]
+
+
+def load_older_peaks(pcon, archive, until):
+    '''
+    The peaks of the history before the data of the snapshot, aggregated by the storage: a few thousand rows,
+    whatever the number of years of history
+    '''
+    return data_access.read_production_peaks(pcon, archive, until, intervention_dates)
+
+
+def with_envelopes(df, engine):
+    '''
+    Look the envelopes up for the rows a page displays. The energy data itself has no envelope columns, a page only
+    shows a few days of it.
+        Returns:
+            A copy of df with the envelope columns
+    '''
+    df = df.copy()
+    for name in envelopes:
+        df[name] = engine.lookup(name, df)
+
+    return df
+
+
+def calculate_envelopes(df, older_peaks=None):
+    '''
+        Parameters:
+            older_peaks: the peaks of the history before df, see load_older_peaks
+        Returns:
+            The EnvelopeEngine holding the envelopes of df
+    '''
+    engine = EnvelopeEngine(envelopes)
+    if older_peaks is not None:
+        engine.update(older_peaks)
+    engine.update(peak_rows(df))
+
+    return engine
+
+
+def append_data(previous, df_new, since):
+    '''
+    Replace the rows after since by the new rows, and add the new rows to the envelopes
+        Returns:
+            The data, and the EnvelopeEngine holding the envelopes
+    '''
+    df_old = previous["data"]
+    df_old = df_old[df_old["Time"] <= since]
+
+    # the engine of the previous snapshot is shared with the sessions still reading it
+    engine = previous["envelopes"].copy()
+    engine.update(peak_rows(df_new))
+
+    return pd.concat([df_old, df_new[df_old.columns]], ignore_index=True), engine
+
+
+def append_since(previous, watermark):
+    '''
+        Returns:
+            The time after which the previous snapshot must be re-read to catch up with the watermark: the oldest
+            complete_until of the streams of the view. None when the snapshot must be loaded again completely, e.g.
+            when the streams backfilled older history.
+    '''
+    if previous is None or previous["data"].empty:
+        return None
+
+    old = {(row[0], row[1]): row[2] for row in previous["watermark"]}
+    since = []
+    for system_id, type, complete_until, last_end_at in watermark:
+        if type not in energy_view.view_types:
+            continue
+        old_complete_until = old.get((system_id, type))
+        if old_complete_until is None or complete_until is None or complete_until < old_complete_until:
+            return None
+        # a stream without rows, like the battery of a site without battery, adds nothing to the snapshot: its
+        # complete_until only moves once a day has closed
+        if last_end_at is None:
+            continue
+        since.append(old_complete_until)
+
+    # the streams completed days that were already loaded, they hold rows older than the new rows
+    if not since or min(since) < previous["data"]["Time"].max() - timedelta(days=1):
+        return None
+
+    return min(since)
+
+
+def load_dataset(watermark, previous=None):
+    '''
+    Load the snapshot of the shared dataset: the telemetry, its envelopes and the rollups. When the previous snapshot
+    is only behind by the newest intervals, these are read and appended to it, otherwise everything is loaded again.
+        Returns:
+            The snapshot, and whether it holds the import intervals up to the watermark. The loader refreshes the
+            energy_wide view after it advanced the watermarks, a snapshot loaded in between is loaded again.
+    '''
+    pcon, archive = storage()
+    since = append_since(previous, watermark)
+
+    if since is None:
+        # only the recent history is held in memory, the pages read older days when they need them (see data_range).
+        # The envelopes still cover the whole history, from peaks aggregated by the storage
+        start = pd.Timestamp(date.today()) - timedelta(days=data_access.app_config().get("app_history_days", 35))
+        data = load_energy_data(pcon, archive, after=start - timedelta(seconds=1))
+        engine = calculate_envelopes(data, load_older_peaks(pcon, archive, start - timedelta(seconds=1)))
+        # pre-aggregated by the loader, read instead of regrouping the 15 minute data
+        rollup_data = data_access.read_rollups(pcon, archive=archive)
+        extent = data_access.read_time_extent(pcon, archive)
+        history = OrderedDict()
+    else:
+        start, history = previous["start"], previous["history"]
+        df_new = load_energy_data(pcon, archive, after=since)
+        data, engine = append_data(previous, df_new, since)
+        rollup_data = data_access.update_rollups(previous["rollups"], pcon, since, archive)
+        first, last = previous["extent"]
+        if not df_new.empty:
+            extent = (first or df_new["Time"].min(), max(last or df_new["Time"].max(), df_new["Time"].max()))
+        else:
+            extent = (first, last)
+        print(f"Dataset: {len(df_new)} rows re-read after {since}")
+
+    last_end_at = [row[3] for row in watermark if row[1] == "import" and row[3] is not None]
+    complete = not last_end_at or (not data.empty and data["Time"].max() >= max(last_end_at))
+
+    snapshot = {
+        "data": data,
+        "envelopes": engine,
+        "rollups": rollup_data,
+        # the watermark the data is known to be up to date with, the next append re-reads the data after it
+        "watermark": watermark if complete else () if since is None else previous["watermark"],
+        # data holds the intervals from start, extent is the time range of the whole history
+        "start": start,
+        "extent": extent,
+        # the older months read by the pages, shared by the versions of the snapshot until the next full load
+        "history": history
+    }
+
+    return snapshot, complete
+
+
+def older_history(snapshot, start, end=None, system_id=None, columns=None):
+    '''
+    Read the intervals before the data of the snapshot, from start (from the first interval when None) up to end
+    (included, up to the data of the snapshot when None). The storage is read once per month, system and columns,
+    the months are kept in the least recently used cache of the snapshot.
+        Returns:
+            The intervals, with their calendar columns
+    '''
+    first = snapshot["extent"][0] if start is None else start
+    last = snapshot["start"] - timedelta(seconds=1)
+    if end is not None:
+        last = min(last, pd.Timestamp(end))
+    if first is None or pd.Timestamp(first) > last:
+        return pd.DataFrame()
+
+    history = snapshot["history"]
+    key_columns = None if columns is None else tuple(columns)
+    months = pd.period_range(pd.Timestamp(first).to_period("M"), last.to_period("M"), freq="M")
+    chunks = {}
+    for month in months:
+        chunks[month] = history.get((month, system_id, key_columns))
+        if chunks[month] is not None:
+            history.move_to_end((month, system_id, key_columns))
+    missing = [month for month, chunk in chunks.items() if chunk is None]
+
+    if missing:
+        # a single query for the missing months, split in months for the cache
+        after = missing[0].to_timestamp() - timedelta(seconds=1)
+        until = min(missing[-1].end_time.floor("s"), snapshot["start"] - timedelta(seconds=1))
+        df = load_energy_data(*storage(), after, until, system_id, columns)
+        by_month = dict(list(df.groupby(df["Time"].dt.to_period("M"))))
+        for month in missing:
+            chunks[month] = by_month.get(month, df.iloc[:0])
+            history[(month, system_id, key_columns)] = chunks[month]
+
+        while len(history) > data_access.app_config().get("app_history_cache_months", 36):
+            history.popitem(last=False)
+
+    df = pd.concat(list(chunks.values()), ignore_index=True)
+
+    return df[(df["Time"] >= pd.Timestamp(first)) & (df["Time"] <= last)]
+
+
+def energy_range(snapshot, start=None, end=None, system_id=None, columns=None):
+    '''
+    The intervals between start and end (both included), of one system or all of them. Older history than the data
+    of the snapshot is read from the storage.
+        Parameters:
+            columns: the metrics the caller needs (e.g. ["Produced"]), all by default. The System Id, Time and
+                     calendar columns are always included.
+        Returns:
+            A dataframe like the data of the snapshot
+    '''
+    df = snapshot["data"]
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= df["Time"] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= df["Time"] <= pd.Timestamp(end)
+    if system_id is not None:
+        mask &= df["System Id"] == system_id
+
+    if columns is not None:
+        metrics = [column for column in co.energy_column_mapping.values() if column not in ["System Id", "Time"]]
+        df = df[[column for column in df.columns if column not in metrics or column in columns]]
+    df = df[mask]
+
+    if start is None or pd.Timestamp(start) < snapshot["start"]:
+        older = older_history(snapshot, start, end, system_id, columns)
+        if not older.empty:
+            df = pd.concat([older[df.columns], df], ignore_index=True)
+
+    return df
@@ -0,0 +1,17 @@
+# The energy_wide materialized view (sql/create_db.sql): the telemetry streams the app shows, joined in one row per
+# system and interval, with the app's sign convention.
+
+from sqlalchemy import text
+
+view_name = "energy_wide"
+
+# the telemetry types the view reads
+view_types = ["production_meter", "consumption", "import", "export", "battery"]
+
+
+def refresh_energy_view(pcon):
+    '''
+    Refresh energy_wide concurrently: the app keeps reading the previous contents while the view is recomputed
+    '''
+    with pcon.begin() as connection:
+        connection.execute(text(f"refresh materialized view concurrently {view_name}"))
@@ -4,24 +4,143 @@
 
 # import datetime
 import json
+import os
 import requests
 import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 import http
 from base64 import b64encode
 from datetime import date, datetime, timedelta
-from time import sleep
+from time import sleep, localtime
 
 import logging
+import numpy as np
 import pandas as pd
 
+from scheduler import RequestScheduler
+from response_cache import ResponseCache
+from urllib.parse import urlsplit, parse_qsl
+
 def concatenate(data, property):
     data[property] = list(itertools.chain(*data[property]))
 
     return data
 
+def epoch_to_datetime(values):
+    '''
+    Convert epoch seconds to naive local datetimes, with the same result as datetime.fromtimestamp applied to each
+    value. The UTC offset is looked up once per distinct hour and added to all values in a single vectorized call.
+    In the hours where the offset changes, e.g. the daylight saving time changes of the half hour zones
+    (Newfoundland, Lord Howe), it is looked up for each value.
+        Returns:
+            A DatetimeIndex
+    '''
+    epochs = np.asarray(values, dtype="int64")
+    hours, inverse = np.unique(epochs // 3600, return_inverse=True)
+    starts = np.fromiter((localtime(int(hour) * 3600).tm_gmtoff for hour in hours), dtype="int64", count=len(hours))
+    ends = np.fromiter((localtime(int(hour) * 3600 + 3599).tm_gmtoff for hour in hours), dtype="int64",
+                       count=len(hours))
+
+    offsets = starts[inverse]
+    changing = (starts != ends)[inverse]
+    offsets[changing] = [localtime(int(epoch)).tm_gmtoff for epoch in epochs[changing]]
+
+    return pd.to_datetime(epochs + offsets, unit="s")
+
+def records_to_dataframe(records, meta=None, timestamp_columns=None, sep="."):
+    '''
+    Build a dataframe column by column from a list of interval records. Nested records, like the charge, discharge
+    and soc objects of the battery telemetry, are flattened into "charge.enwh" style columns, as json_normalize does.
+        Parameters:
+            meta: a dictionary of constant values to add as columns, e.g. the system_id of the response
+            timestamp_columns: the columns holding epoch seconds, converted to local datetimes
+        Returns:
+            The dataframe
+    '''
+    columns = {}
+
+    # the union of the keys of all records defines the columns, like json_normalize, missing values become NaN
+    keys = {}
+    for record in records:
+        keys.update(dict.fromkeys(record))
+
+    for key in keys:
+        values = [r.get(key) for r in records]
+        nested = [value for value in values if isinstance(value, dict)]
+        if nested:
+            sub_keys = {}
+            for value in nested:
+                sub_keys.update(dict.fromkeys(value))
+            for sub_key in sub_keys:
+                columns[f"{key}{sep}{sub_key}"] = [value.get(sub_key) if isinstance(value, dict) else None
+                                                   for value in values]
+        else:
+            columns[key] = values
+
+    for key, value in (meta or {}).items():
+        columns[key] = np.full(len(records), value)
+
+    df = pd.DataFrame(columns)
+
+    for col in (timestamp_columns or []):
+        df[col] = epoch_to_datetime(df[col]) if col in df.columns else pd.Series(dtype="datetime64[ns]")
+
+    return df
+
+def deduplicate_intervals(intervals):
+    '''
+    Remove intervals with an end_at that was already seen. Nested intervals (a list of lists, as returned by the
+    energy import/export telemetry) keep their nesting, inner lists that become empty are dropped.
+        Returns:
+            The list of intervals, without duplicates
+    '''
+    seen = set()
+
+    def keep(interval):
+        if interval["end_at"] in seen:
+            return False
+        seen.add(interval["end_at"])
+        return True
+
+    if len(intervals) > 0 and type(intervals[0]) == list:
+        nested = [[intv for intv in sublist if keep(intv)] for sublist in intervals]
+        return [sublist for sublist in nested if len(sublist) > 0]
+
+    return [intv for intv in intervals if keep(intv)]
+
 class enlightenAPI_v4:
 
+    # Time to live (in seconds) of cached responses, by the first fragment found in the last segment of the endpoint
+    # path (the route, "systems" for the details of a system). Routes matching no fragment, like the telemetry and
+    # rgm_stats, get the time to live of the first entry. Telemetry windows that are closed are cached without time
+    # to live.
+    cache_ttl = [
+        ("telemetry", 15 * 60),
+        ("summary", 15 * 60),
+        ("lifetime", 60 * 60),
+        ("devices", 24 * 60 * 60),
+        ("systems", 24 * 60 * 60)
+    ]
+
+    # The access token is refreshed when it expires within this margin, long running loaders outlive it
+    token_margin = timedelta(minutes=10)
+
+    # Defaults for the pooled HTTP session, overridable with the "http" section of the config
+    http_defaults = {
+        "pool_connections": 4,
+        "pool_maxsize": 10,
+        "connect_timeout": 5,
+        "read_timeout": 30,
+        "headers": {
+            "Accept": "application/json",
+            "Connection": "keep-alive",
+            "User-Agent": "py-shiny-enphase"
+        }
+    }
+
     telemetry_info = {
         "production_micro": {
             "path": "telemetry/production_micro",
@@ -82,6 +201,156 @@ class enlightenAPI_v4:
                 res.raise_for_status()
         return True
 
+    def __create_session(self):
+        '''
+        Create the HTTP session shared by all API calls. The session keeps connections alive, so only the first call
+        to the API pays for the TCP and TLS handshake.
+            Returns:
+                A requests.Session with a pooled adapter and the default headers
+        '''
+        http_config = {**self.http_defaults, **self.config.get("http", {})}
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=http_config["pool_connections"],
+                              pool_maxsize=http_config["pool_maxsize"])
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({**self.http_defaults["headers"], **http_config["headers"]})
+
+        self.timeout = (http_config["connect_timeout"], http_config["read_timeout"])
+
+        return session
+
+    def __create_scheduler(self):
+        rate_limits = self.config.get("rate_limits", {})
+
+        return RequestScheduler(per_minute=rate_limits.get("per_minute", 10),
+                                per_month=rate_limits.get("per_month", 1000),
+                                state_file=rate_limits.get("state_file", "data/call_budget.json"))
+
+    def __get(self, url, priority=None):
+        self.__ensure_token()
+        token = self.config["access_token"]
+        response = self.__send(url, token, priority)
+
+        if response.status_code == http.HTTPStatus.UNAUTHORIZED:
+            # the token was rejected before its expiry date, refresh it and try once more
+            self.__ensure_token(rejected=token)
+            response = self.__send(url, self.config["access_token"], priority)
+
+        return response
+
+    def __send(self, url, token, priority=None):
+        self.scheduler.acquire(priority)
+        response = self.session.get(url,
+                                    headers={'Authorization': 'Bearer ' + token},
+                                    timeout=self.timeout)
+        if response.status_code == http.HTTPStatus.TOO_MANY_REQUESTS:
+            self.scheduler.throttled()
+
+        return response
+
+    def __ensure_token(self, rejected=None):
+        '''
+        Refresh the access token when it expires within token_margin, or when the API rejected it. The threads of the
+        loader share the client: the first one refreshes the token, the others wait for it and use the new token.
+            Parameters:
+                rejected: the access token the API answered 401 to
+        '''
+        with self.token_lock:
+            if rejected is not None:
+                if rejected != self.config["access_token"]:
+                    return
+            else:
+                expiry_date = datetime.strptime(self.config["expiry_date"], "%Y-%m-%d %H:%M:%S")
+                if expiry_date > datetime.now() + self.token_margin:
+                    return
+
+            self.authenticate()
+
+    def __create_cache(self):
+        cache_config = self.config.get("cache", {})
+
+        return ResponseCache(directory=cache_config.get("directory", "data/cache"),
+                             max_size_mb=cache_config.get("max_size_mb", 200),
+                             mode=cache_config.get("mode", "normal"))
+
+    def __get_json(self, url, priority=None, closed=False, refresh=False):
+        '''
+        Get the parsed json response of url, from the response cache if possible.
+            Parameters:
+                closed: True if the response can't change anymore, it is then cached without time to live
+                refresh: True to call the API even if the response is cached (except in replay mode), and replace
+                         the cached response
+            Returns:
+                The parsed json response
+        '''
+        parts = urlsplit(url)
+        endpoint = parts.path
+        # the api key identifies the application, not the request
+        params = {key: value for key, value in parse_qsl(parts.query) if key != "key"}
+
+        if not refresh or self.cache.mode == "replay":
+            result = self.cache.get(endpoint, params)
+            if result is not None:
+                return result
+
+        response = self.__get(url, priority=priority)
+        self.__assert_success(response)
+        result = json.loads(response.text)
+
+        self.cache.put(endpoint, params, result, ttl=None if closed else self.__get_cache_ttl(endpoint))
+
+        return result
+
+    def __get_cache_ttl(self, endpoint):
+        route = endpoint.rstrip("/").split("/")[-1]
+        if route.isdigit():
+            route = "systems"
+
+        for fragment, ttl in self.cache_ttl:
+            if fragment in route:
+                return ttl
+
+        return self.cache_ttl[0][1]
+
+    def __is_closed_window(self, start_date, end_date, start_at, end_at, granularity):
+        '''
+        Determine if the requested window lies far enough in the past for Enphase to have published all its data.
+            Returns:
+                True if the window is closed
+        '''
+        if end_at is not None:
+            window_end = end_at
+        elif end_date is not None:
+            window_end = datetime.combine(end_date, datetime.max.time())
+        elif start_at is not None and granularity is not None:
+            window_end = start_at + self.__get_period(granularity)
+        else:
+            return False
+
+        return window_end < self.closed_before()
+
+    def closed_before(self):
+        '''
+            Returns:
+                The time up to which Enphase has published all data: the windows ending before it are closed
+        '''
+        return datetime.now() - timedelta(hours=self.config.get("cache", {}).get("closed_after_hours", 24))
+
+    def __post(self, url, auth=None):
+        return self.session.post(url, auth=auth, timeout=self.timeout)
+
+    def remaining_budget(self):
+        '''
+            Returns:
+                The number of API calls left, for the current minute and for the month
+        '''
+        return self.scheduler.remaining()
+
+    def close(self):
+        self.session.close()
+
     def __log_time(self):
         return datetime.now().strftime('%Y-%m-%d %I:%M:%S') + ": "
 
@@ -91,19 +360,35 @@ class enlightenAPI_v4:
         except requests.HTTPError as e:
             self.__get_access_token()
 
-    def get_systems(self):
+    def get_systems(self, page=1, size=10):
         '''
         Run the enlighten API Fetch Systems route
             Returns:
                 Returns a list of systems for which the user can make API requests. By default, systems are returned in batches of 10. The maximum size is 100.
         '''
-        url = f'{self.config["api_url"]}api/v4/systems/?key={self.config["app_api_key"]}'
-        response = requests.get(url, headers={'Authorization': 'Bearer ' + self.config["access_token"]})
-        self.__assert_success(response)
-        result = json.loads(response.text)
-        self.__save_result(result, "data/systems.json")
+        url = f'{self.config["api_url"]}api/v4/systems/?key={self.config["app_api_key"]}&page={page}&size={size}'
+        result = self.__get_json(url)
+        self.__save_result(result, f"data/systems_{page}.json")
         return result
 
+    def get_all_systems(self, size=100):
+        '''
+        Page through the enlighten API Fetch Systems route
+            Returns:
+                Returns the list of all systems for which the user can make API requests
+        '''
+        systems = []
+        page = 1
+
+        while True:
+            result = self.get_systems(page=page, size=size)
+            systems += result["systems"]
+
+            if len(result["systems"]) < size or len(systems) >= result.get("total", 0):
+                return systems
+
+            page += 1
+
     def get_system(self, system_id):
         '''
                 Run the enlighten API Fetch Systems route
@@ -111,9 +396,7 @@ class enlightenAPI_v4:
                         Returns a list of systems for which the user can make API requests. By default, systems are returned in batches of 10. The maximum size is 100.
                 '''
         url = f'{self.config["api_url"]}api/v4/systems/{system_id}?key={self.config["app_api_key"]}'
-        response = requests.get(url, headers={'Authorization': 'Bearer ' + self.config["access_token"]})
-        self.__assert_success(response)
-        result = json.loads(response.text)
+        result = self.__get_json(url)
         self.__save_result(result, f"data/system_{system_id}.json")
         return result
 
@@ -124,9 +407,7 @@ class enlightenAPI_v4:
                 Returns a list of systems for which the user can make API requests. By default, systems are returned in batches of 10. The maximum size is 100.
         '''
         url = f'{self.config["api_url"]}api/v4/systems/{system_id}/summary/?key={self.config["app_api_key"]}'
-        response = requests.get(url, headers={'Authorization': 'Bearer ' + self.config["access_token"]})
-        self.__assert_success(response)
-        result = json.loads(response.text)
+        result = self.__get_json(url)
         self.__save_result(result, f"data/system_{system_id}_summary.json")
         return result
 
@@ -137,9 +418,7 @@ class enlightenAPI_v4:
                         Returns a list of systems for which the user can make API requests. By default, systems are returned in batches of 10. The maximum size is 100.
                 '''
         url = f'{self.config["api_url"]}api/v4/systems/{system_id}/devices/?key={self.config["app_api_key"]}'
-        response = requests.get(url, headers={'Authorization': 'Bearer ' + self.config["access_token"]})
-        self.__assert_success(response)
-        result = json.loads(response.text)
+        result = self.__get_json(url)
         self.__save_result(result, f"data/system_{system_id}_devices.json")
         return result
 
@@ -154,13 +433,11 @@ class enlightenAPI_v4:
         '''
         print(self.__log_time() + "Pulling EnlightenAPI inverter summary...")
         url = f'{self.config["api_url"]}api/v4/systems/inverters_summary_by_envoy_or_site?key={self.config["app_api_key"]}&site_id={self.config["system_id"]}'
-        response = requests.get(url, headers={'Authorization': 'Bearer ' + self.config["access_token"]})
-        self.__assert_success(response)
-        result = json.loads(response.text)
+        result = self.__get_json(url)
         return result
 
 
-    def load_monitoring_data(self, system_id, stat_name, start_date=None, end_date=None, start_at=None, end_at=None, **kwargs):
+    def load_monitoring_data(self, system_id, stat_name, start_date=None, end_date=None, start_at=None, end_at=None, priority=None, refresh=False, **kwargs):
         '''
         Run the enlighten API inverters_summary_by_envoy_or_site route (https://developer-v4.enphase.com/docs.html).
         This route returns the detailed information for each inverter (including lifetime power produced). Note: if your Envoy is connected via low
@@ -168,6 +445,9 @@ class enlightenAPI_v4:
         complete data.
             Returns:
                 Returns the microinverters summary based on the specified active envoy serial number or system.
+
+        Calls are paced by the request scheduler. When several calls wait for budget, the one with the highest
+        priority goes first. With refresh, the API is called even if the response is cached.
         '''
         start_at_cond = self.__get_timestamp_condition("start_at", start_at)
         end_at_cond = self.__get_timestamp_condition("end_at", end_at)
@@ -182,11 +462,8 @@ class enlightenAPI_v4:
 
         print(f"get stats for {stat_name}: {url}")
 
-        response = requests.get(url, headers={'Authorization': 'Bearer ' + self.config["access_token"]})
-        self.__assert_success(response)
-        result = json.loads(response.text)
-
-        # sleep(6)
+        closed = self.__is_closed_window(start_date, end_date, start_at, end_at, kwargs.get("granularity"))
+        result = self.__get_json(url, priority=priority, closed=closed, refresh=refresh)
 
         return result
 
@@ -196,9 +473,9 @@ class enlightenAPI_v4:
         result = self.load_monitoring_data(system_id, "rgm_stats", start_at, end_at)
         self.__save_result(result, "data/prod_summary.json")
 
-        df = pd.DataFrame.from_records(result["intervals"])
+        df = records_to_dataframe(result["intervals"], timestamp_columns=["end_at"])
         df["Produced"] = df["wh_del"]
-        df["Date"] = df["end_at"].apply(lambda x : datetime.fromtimestamp(x))
+        df["Date"] = df["end_at"]
 
         return df[["Date","Produced"]]
 
@@ -210,10 +487,41 @@ class enlightenAPI_v4:
         return result
 
 
-    def telemetry(self, system_id, telemetry_type, start_at=None, granularity="week", as_type="json"):
+    def telemetry(self, system_id, telemetry_type, start_at=None, granularity="week", as_type="json", parallel=False, max_workers=4, end_at=None, refresh=False):
+        '''
+        Load the telemetry of the given type, from start_at up to end_at (default now), in windows of the given granularity.
+        By default the windows are fetched one after the other, each window starting after the last interval
+        loaded by the previous one. With parallel=True, all windows are fetched at once by a pool of max_workers
+        threads, and overlapping intervals are removed afterwards.
+        With refresh=True, the windows are fetched from the API even if their responses are cached, e.g. to repair
+        the holes of windows that were cached before their data was uploaded.
+            Returns:
+                The merged API result, as json or as a dataframe depending on as_type
+        '''
+        properties = self.telemetry_info[telemetry_type]
+        start_dates = self.__get_date_range(start_at, end_at, granularity=granularity)
+
+        if parallel:
+            result = self.__telemetry_parallel(system_id, telemetry_type, start_dates, granularity, max_workers, refresh)
+        else:
+            result = self.__telemetry_sequential(system_id, telemetry_type, start_dates, granularity, refresh)
+
+        if as_type == "json":
+            return result
+        elif as_type == "dataframe":
+            return self.__to_dataframe(result,
+                                       ["intervals"],
+                                       meta=["system_id"],
+                                       timestamp_columns=["end_at"],
+                                       index="end_at",
+                                       column_names=properties["column_names"],
+                                       preprocess=properties["preprocess"],
+                                       preprocess_property=properties["preprocess_property"])
+
+
+    def __telemetry_sequential(self, system_id, telemetry_type, start_dates, granularity, refresh=False):
         properties = self.telemetry_info[telemetry_type]
         result = None
-        start_dates = self.__get_date_range(start_at, granularity=granularity)
         max_loaded_date = None
 
         for next_date in start_dates:
@@ -225,9 +533,12 @@ class enlightenAPI_v4:
             tmp_result = self.load_monitoring_data(system_id,
                                                    properties["path"],
                                                    start_at=start_at,
-                                                   end_at=None, granularity=granularity)
+                                                   end_at=None,
+                                                   priority=start_at.timestamp(),
+                                                   refresh=refresh,
+                                                   granularity=granularity)
 
-            self.__save_result(result, f"data/telemetry/{telemetry_type}_{start_at.strftime('%Y%m%d_%H%M%S')}.json")
+            self.__save_result(tmp_result, f"data/telemetry/{telemetry_type}_{start_at.strftime('%Y%m%d_%H%M%S')}.json")
 
             intervals = tmp_result["intervals"]
             if len(intervals) > 0:
@@ -249,17 +560,38 @@ class enlightenAPI_v4:
             else:
                 result["intervals"] += tmp_result["intervals"]
 
-        if as_type == "json":
-            return result
-        elif as_type == "dataframe":
-            return self.__to_dataframe(result,
-                                       ["intervals"],
-                                       meta=["system_id"],
-                                       timestamp_columns=["end_at"],
-                                       index="end_at",
-                                       column_names=properties["column_names"],
-                                       preprocess=properties["preprocess"],
-                                       preprocess_property=properties["preprocess_property"])
+        return result
+
+
+    def __telemetry_parallel(self, system_id, telemetry_type, start_dates, granularity, max_workers, refresh=False):
+        properties = self.telemetry_info[telemetry_type]
+
+        def load_window(start_at):
+            return self.load_monitoring_data(system_id,
+                                             properties["path"],
+                                             start_at=start_at,
+                                             end_at=None,
+                                             priority=start_at.timestamp(),
+                                             refresh=refresh,
+                                             granularity=granularity)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # submit the most recent windows first, so they get the call budget before the older ones.
+            # map keeps the order of its input, reversing the results sorts the intervals on end_at again
+            results = list(executor.map(load_window, reversed(start_dates)))[::-1]
+
+        result = None
+        for tmp_result in results:
+            if result is None:
+                result = tmp_result
+            else:
+                result["intervals"] += tmp_result["intervals"]
+
+        # consecutive windows share their boundary interval
+        if result is not None:
+            result["intervals"] = deduplicate_intervals(result["intervals"])
+
+        return result
 
 
     # def telemetry_production_micro(self, system_id, start_at=None, granularity="week", as_type="json"):
@@ -339,6 +671,11 @@ class enlightenAPI_v4:
 
 
     def __save_result(self, result, path):
+        # Raw results are only written out for debugging, the response cache keeps the responses for reuse
+        if not self.config.get("save_results", False):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, 'w') as f:
             json.dump(result, f, indent=4)
 
@@ -359,7 +696,7 @@ class enlightenAPI_v4:
         print(self.__log_time() + "Refreshing access_token...")
         url = f'{self.config["api_url"]}oauth/token?grant_type=authorization_code&redirect_uri=https://api.enphaseenergy.com/oauth/redirect_uri&code={self.config["code"]}'
         # Enlighten API v4 Quickstart says this should be a GET request, but that seems to be incorrect. POST works.
-        response = requests.post(url, auth=(self.config['app_client_id'], self.config['app_client_secret']))
+        response = self.__post(url, auth=(self.config['app_client_id'], self.config['app_client_secret']))
         refresh_successful = self.__assert_success(response, False)
         if not refresh_successful:
             print(
@@ -395,7 +732,7 @@ class enlightenAPI_v4:
         print(self.__log_time() + "Refreshing access_token...")
         url = f'{self.config["api_url"]}oauth/token?grant_type=refresh_token&refresh_token={self.config["refresh_token"]}'
         # Enlighten API v4 Quickstart says this should be a GET request, but that seems to be incorrect. POST works.
-        response = requests.post(url, auth=(self.config['app_client_id'], self.config['app_client_secret']))
+        response = self.__post(url, auth=(self.config['app_client_id'], self.config['app_client_secret']))
         refresh_successful = self.__assert_success(response, False)
         if not refresh_successful:
             print(
@@ -441,16 +778,12 @@ class enlightenAPI_v4:
         if preprocess is not None:
             data = preprocess(data, kwargs["preprocess_property"])
 
-        df = pd.json_normalize(
-            data,
-            record_path=record_path,
-            meta=meta,
-            meta_prefix=meta_prefix
-        )
+        records = data
+        for key in ([record_path] if isinstance(record_path, str) else record_path or []):
+            records = records[key]
 
-        if timestamp_columns is not None:
-            for col in timestamp_columns:
-                df[col] = df[col].apply(lambda x: datetime.fromtimestamp(x))
+        meta_values = {f"{meta_prefix}{key}": data[key] for key in (meta or [])}
+        df = records_to_dataframe(records, meta=meta_values, timestamp_columns=timestamp_columns)
 
         if drop_duplicates:
             df = df.drop_duplicates()
@@ -465,16 +798,21 @@ class enlightenAPI_v4:
 
 
 
-    def __get_date_range(self, start_date, end_date = datetime.now(), granularity = "week"):
-        dates = [start_date]
+    def __get_period(self, granularity):
         if granularity == "day":
-            period = timedelta(days=1)
+            return timedelta(days=1)
         elif granularity == "week":
-            period = timedelta(days=7)
+            return timedelta(days=7)
         elif granularity == "15mins":
-            period = timedelta(hours=1)
+            return timedelta(hours=1)
         else:
-            None
+            raise ValueError(f"Unsupported granularity {granularity}")
+
+    def __get_date_range(self, start_date, end_date=None, granularity="week"):
+        # the default end date is evaluated on every call, not once when the module is loaded
+        end_date = datetime.now() if end_date is None else end_date
+        dates = [start_date]
+        period = self.__get_period(granularity)
 
         next_date = start_date + period
 
@@ -492,6 +830,14 @@ class enlightenAPI_v4:
                 The API configuration (as a dictionary). Must contain api_url, api_key, and secrets
         '''
         self.config = config
+        self.token_lock = threading.Lock()
+        self.session = self.__create_session()
+        self.scheduler = self.__create_scheduler()
+        self.cache = self.__create_cache()
+
+        # In replay mode, all responses come from the cache, no tokens are needed
+        if self.cache.mode == "replay":
+            return
 
         # It seems the v4 API allows you to only call the OAuth POST route with grant_type=authorization_code a SINGLE time for a auth_code.
         # So we need to make sure those already exist.
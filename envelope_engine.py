@@ -0,0 +1,103 @@
+# Envelopes of the maximum production, the "Max Produced" lines of the app.
+# Per group (the whole history, a Month or a Week) and time-of-day slot, the peak is the maximum production of the
+# history. The envelope flattens the peaks so it only rises until the highest peak of the day and only falls after:
+# the minimum of the running maximum from midnight and the running maximum from the end of the day.
+# Peaks and envelopes are small NumPy tables indexed by (group value, slot): new rows only recompute the envelopes of
+# the groups whose peaks moved, and rows look their envelope up by indexing.
+
+import numpy as np
+
+# the number of slots of a day, see data_access.slot_length
+slots = 96
+
+# the number of rows of the tables of a group column: the group values are the row numbers
+group_sizes = {
+    None: 1,
+    "Month": 13,
+    "Week": 53
+}
+
+
+def envelope_rows(peaks):
+    '''
+    Compute the envelopes of a table of peaks, one group per row, vectorized over the groups
+        Returns:
+            A table like peaks. Slots without peak (NaN) have no envelope.
+    '''
+    forward = np.fmax.accumulate(peaks, axis=1)
+    backward = np.fmax.accumulate(peaks[:, ::-1], axis=1)[:, ::-1]
+    envelopes = np.fmin(forward, backward)
+    envelopes[np.isnan(peaks)] = np.nan
+
+    return envelopes
+
+
+class EnvelopeEngine:
+
+    def __init__(self, groups):
+        '''
+        Initialize the engine without peaks
+            Parameters:
+                groups: a dictionary of envelope name -> group column (None for the whole history)
+        '''
+        self.groups = groups
+        self.peaks = {name: np.full((group_sizes[group], slots), np.nan) for name, group in groups.items()}
+        self.tables = {name: np.full((group_sizes[group], slots), np.nan) for name, group in groups.items()}
+
+    def copy(self):
+        engine = EnvelopeEngine(self.groups)
+        engine.peaks = {name: table.copy() for name, table in self.peaks.items()}
+        engine.tables = {name: table.copy() for name, table in self.tables.items()}
+
+        return engine
+
+    def group_index(self, name, df):
+        group = self.groups[name]
+        if group is None:
+            return np.zeros(len(df), dtype="int64")
+
+        return df[group].to_numpy(dtype="int64")
+
+    def update(self, df, column="Produced"):
+        '''
+        Add the peaks of rows, and recompute the envelopes of the groups whose peaks moved
+            Parameters:
+                df: the rows, with the group columns, Slot and column. Rows of many days, systems or already
+                    aggregated peaks (see data_access.read_production_peaks) can be mixed.
+            Returns:
+                A dictionary of envelope name -> boolean table of the (group, slot) envelopes that changed
+        '''
+        # the maximum per (group values, slot) of the rows in a single unbuffered pass, over the joint table of all
+        # group columns; the peaks of each envelope are its maximum over the group columns of the other envelopes
+        columns = [group for group in self.groups.values() if group is not None]
+        shape = tuple(group_sizes[group] for group in columns) + (slots,)
+        index = np.ravel_multi_index([df[group].to_numpy(dtype="int64") for group in columns] +
+                                     [df["Slot"].to_numpy(dtype="int64")], shape)
+        joint_peaks = np.full(np.prod(shape), np.nan)
+        np.fmax.at(joint_peaks, index, df[column].to_numpy(dtype="float64"))
+        joint_peaks = joint_peaks.reshape(shape)
+
+        changed = {}
+        for name, group in self.groups.items():
+            axes = tuple(axis for axis, other in enumerate(columns) if other != group)
+            new_peaks = np.fmax.reduce(joint_peaks, axis=axes) if axes else joint_peaks
+            new_peaks = new_peaks.reshape(self.peaks[name].shape)
+
+            peaks = np.fmax(self.peaks[name], new_peaks)
+            moved = (peaks != self.peaks[name]) & ~np.isnan(peaks)
+            self.peaks[name] = peaks
+
+            rows = moved.any(axis=1)
+            table = self.tables[name].copy()
+            table[rows] = envelope_rows(peaks[rows])
+            changed[name] = ~((table == self.tables[name]) | (np.isnan(table) & np.isnan(self.tables[name])))
+            self.tables[name] = table
+
+        return changed
+
+    def lookup(self, name, df):
+        '''
+            Returns:
+                The envelope of the rows of df (with the group column of the envelope and Slot), as float32
+        '''
+        return self.tables[name][self.group_index(name, df), df["Slot"].to_numpy(dtype="int64")].astype("float32")
@@ -0,0 +1,406 @@
+# Local stand-in for the Enphase Enlighten API v4, for benchmarks and offline development.
+# It serves the routes used by enlightenAPI_v4 with deterministic synthetic data: the same seed, system and
+# timestamp always give the same values, and any window of history can be requested.
+# Latency and 429 (Too Many Requests) responses can be injected to exercise the client under load.
+#
+# Run from the repository root:
+#     python fake_enphase.py --port 8000 --systems 3 --latency 50 --error-rate 0.05
+# and point "api_url" in the config to http://127.0.0.1:8000/
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import urlsplit, parse_qsl
+
+INTERVAL = 900
+
+periods = {
+    "15mins": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(days=7)
+}
+
+
+class FakeEnphaseData:
+
+    def __init__(self, seed=0, systems=1, history_days=365):
+        '''
+        Initialize the synthetic data generator
+            Parameters:
+                seed: the seed of all generated values
+                systems: the number of systems of the fleet
+                history_days: the age of the oldest system, in days
+        '''
+        self.seed = seed
+        self.system_ids = [1000 + i for i in range(systems)]
+        self.history_days = history_days
+
+    def system(self, system_id):
+        rng = random.Random(f"{self.seed}-{system_id}")
+        operational_at = int(time()) - self.history_days * 86400
+
+        return {
+            "system_id": system_id,
+            "name": f"Fake System {system_id}",
+            "public_name": "Residential System",
+            "timezone": "Europe/Brussels",
+            "address": {"city": "Brussels", "country": "BE", "postal_code": "1000"},
+            "connection_type": "ethernet",
+            "energy_lifetime": 0,
+            "energy_today": 0,
+            "system_size": rng.choice([3200, 4800, 6400]),
+            "status": "normal",
+            "last_report_at": int(time()) // INTERVAL * INTERVAL,
+            "last_energy_at": int(time()) // INTERVAL * INTERVAL,
+            "operational_at": operational_at,
+            "attachment_type": "rack_mount",
+            "interconnect_date": datetime.fromtimestamp(operational_at).strftime("%Y-%m-%d"),
+            "reference": None,
+            "other_references": []
+        }
+
+    def values(self, system_id, end_at):
+        '''
+            Returns:
+                The energy flows (in Wh) of the 15 minute interval ending at end_at
+        '''
+        rng = random.Random(f"{self.seed}-{system_id}-{end_at}")
+        moment = datetime.fromtimestamp(end_at)
+        hour = moment.hour + moment.minute / 60
+        day_of_year = moment.timetuple().tm_yday
+
+        # longer and stronger days in summer, clouds randomly cut production
+        day_length = 12 + 4 * math.sin(2 * math.pi * (day_of_year - 80) / 365)
+        sunrise = 13 - day_length / 2
+        sun = max(0.0, math.sin(math.pi * (hour - sunrise) / day_length))
+        peak = 900 + 300 * math.sin(2 * math.pi * (day_of_year - 80) / 365)
+        produced = int(sun * peak * rng.uniform(0.3, 1.0))
+
+        consumed = int(80 + rng.uniform(0, 150) + (250 if 17 <= hour < 21 else 0))
+
+        surplus = produced - consumed
+        charged = int(max(0, surplus) * 0.5)
+        discharged = int(max(0, -surplus) * 0.6)
+        exported = max(0, surplus - charged)
+        imported = max(0, -surplus - discharged)
+        soc = round(50 + 40 * math.sin(2 * math.pi * (hour - 9) / 24), 1)
+
+        return {
+            "produced": produced,
+            "consumed": consumed,
+            "charged": charged,
+            "discharged": discharged,
+            "imported": imported,
+            "exported": exported,
+            "soc": soc,
+            "devices": 12 if produced > 0 else rng.choice([0, 12])
+        }
+
+    def interval_ends(self, start_at, end_at):
+        '''
+            Returns:
+                The end times of all 15 minute intervals after start_at, up to end_at and not in the future
+        '''
+        end_at = min(end_at, int(time()) // INTERVAL * INTERVAL)
+        first = (start_at // INTERVAL + 1) * INTERVAL
+
+        return range(first, end_at + 1, INTERVAL)
+
+    def telemetry(self, system_id, kind, start_at, end_at, granularity):
+        intervals = []
+        for interval_end in self.interval_ends(start_at, end_at):
+            v = self.values(system_id, interval_end)
+            if kind == "production_micro":
+                intervals.append({"end_at": interval_end, "devices_reporting": v["devices"],
+                                  "powr": v["produced"] * 4, "enwh": v["produced"]})
+            elif kind == "production_meter":
+                intervals.append({"end_at": interval_end, "devices_reporting": 1, "wh_del": v["produced"]})
+            elif kind == "consumption_meter":
+                intervals.append({"end_at": interval_end, "devices_reporting": 1, "enwh": v["consumed"]})
+            elif kind == "battery":
+                intervals.append({
+                    "end_at": interval_end,
+                    "charge": {"enwh": v["charged"], "devices_reporting": 1},
+                    "discharge": {"enwh": v["discharged"], "devices_reporting": 1},
+                    "soc": {"percent": v["soc"], "devices_reporting": 1}
+                })
+
+        return {
+            "system_id": system_id,
+            "granularity": granularity,
+            "total_devices": 12,
+            "start_at": start_at,
+            "end_at": end_at,
+            "items": "intervals",
+            "intervals": intervals
+        }
+
+    def energy_telemetry(self, system_id, kind, start_at, end_at):
+        # energy import/export intervals are grouped per day
+        days = {}
+        for interval_end in self.interval_ends(start_at, end_at):
+            v = self.values(system_id, interval_end)
+            day = datetime.fromtimestamp(interval_end - 1).date()
+            days.setdefault(day, []).append({"end_at": interval_end, f"wh_{kind}": v[kind]})
+
+        return {
+            "system_id": system_id,
+            "start_date": datetime.fromtimestamp(start_at).strftime("%Y-%m-%d"),
+            "meter_intervals": None,
+            "items": "intervals",
+            "intervals": list(days.values())
+        }
+
+
+class FakeEnphaseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    routes = [
+        (re.compile(r"^/api/v4/systems/?$"), "systems"),
+        (re.compile(r"^/api/v4/systems/(\d+)/?$"), "system"),
+        (re.compile(r"^/api/v4/systems/(\d+)/summary/?$"), "summary"),
+        (re.compile(r"^/api/v4/systems/(\d+)/devices/?$"), "devices"),
+        (re.compile(r"^/api/v4/systems/(\d+)/telemetry/(production_micro|production_meter|consumption_meter|battery)/?$"), "telemetry"),
+        (re.compile(r"^/api/v4/systems/(\d+)/energy_(import|export)_telemetry/?$"), "energy_telemetry"),
+    ]
+
+    def do_GET(self):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+
+        if not fake.before_request():
+            return self.send_json(429, {"message": "Too Many Requests", "details": "Usage limit exceeded for plan"})
+
+        for pattern, route in self.routes:
+            match = pattern.match(parts.path)
+            if match is None:
+                continue
+
+            system_id = int(match.group(1)) if match.groups() else None
+            if system_id is not None and system_id not in fake.data.system_ids:
+                return self.send_json(404, {"message": "Not Found", "details": f"System {system_id} not found"})
+
+            return self.send_json(200, getattr(self, f"get_{route}")(fake.data, params, *match.groups()))
+
+        self.send_json(404, {"message": "Not Found", "details": parts.path})
+
+    def do_POST(self):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+
+        if not fake.before_request():
+            return self.send_json(429, {"message": "Too Many Requests"})
+
+        if parts.path.rstrip("/") != "/oauth/token":
+            return self.send_json(404, {"message": "Not Found", "details": parts.path})
+
+        token = f"fake-{int(time())}"
+        self.send_json(200, {
+            "access_token": token,
+            "token_type": "bearer",
+            "refresh_token": token,
+            "expires_in": 86399,
+            "scope": "read write",
+            "enl_uid": "1",
+            "enl_cid": "1",
+            "enl_password_last_changed": "0",
+            "is_internal_app": False,
+            "app_type": "system",
+            "jti": token
+        })
+
+    def get_systems(self, data, params):
+        page = int(params.get("page", 1))
+        size = min(int(params.get("size", 10)), 100)
+        system_ids = data.system_ids[(page - 1) * size:page * size]
+
+        return {
+            "total": len(data.system_ids),
+            "current_page": page,
+            "size": size,
+            "count": len(system_ids),
+            "items": "systems",
+            "systems": [data.system(system_id) for system_id in system_ids]
+        }
+
+    def get_system(self, data, params, system_id):
+        return data.system(int(system_id))
+
+    def get_summary(self, data, params, system_id):
+        system = data.system(int(system_id))
+        return {
+            "system_id": system["system_id"],
+            "current_power": 0,
+            "energy_lifetime": 0,
+            "energy_today": 0,
+            "last_interval_end_at": system["last_energy_at"],
+            "last_report_at": system["last_report_at"],
+            "modules": 12,
+            "operational_at": system["operational_at"],
+            "size_w": system["system_size"],
+            "source": "meter",
+            "status": "normal",
+            "summary_date": datetime.now().strftime("%Y-%m-%d")
+        }
+
+    def get_devices(self, data, params, system_id):
+        return {
+            "system_id": int(system_id),
+            "total_devices": 12,
+            "items": "devices",
+            "devices": {"micros": [{"id": i, "serial_number": f"12200{i:05d}", "status": "normal"} for i in range(12)]}
+        }
+
+    def get_telemetry(self, data, params, system_id, kind):
+        start_at, end_at, granularity = self.window(params)
+        return data.telemetry(int(system_id), kind, start_at, end_at, granularity)
+
+    def get_energy_telemetry(self, data, params, system_id, kind):
+        start_at, end_at, granularity = self.window(params)
+        return data.energy_telemetry(int(system_id), f"{kind}ed", start_at, end_at)
+
+    def window(self, params):
+        granularity = params.get("granularity", "day")
+        if "start_at" in params:
+            start_at = int(params["start_at"])
+        elif "start_date" in params:
+            start_at = int(datetime.strptime(params["start_date"], "%Y-%m-%d").timestamp())
+        else:
+            start_at = int(datetime.combine(datetime.now().date(), datetime.min.time()).timestamp())
+
+        end_at = int(params["end_at"]) if "end_at" in params \
+            else start_at + int(periods.get(granularity, periods["day"]).total_seconds())
+
+        return start_at, end_at, granularity
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.fake.verbose:
+            super().log_message(format, *args)
+
+
+class FakeEnphaseServer:
+
+    def __init__(self, host="127.0.0.1", port=0, seed=0, systems=1, history_days=365,
+                 latency_ms=0, error_rate=0.0, verbose=False):
+        '''
+        Initialize the fake API server
+            Parameters:
+                port: the port to listen on, 0 to pick a free port
+                latency_ms: the delay added to every response, in milliseconds
+                error_rate: the fraction of requests answered with 429 Too Many Requests
+        '''
+        self.data = FakeEnphaseData(seed=seed, systems=systems, history_days=history_days)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.request_count = 0
+        self.throttled_count = 0
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+
+        self.httpd = ThreadingHTTPServer((host, port), FakeEnphaseHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def before_request(self):
+        '''
+        Count the request and apply the injected latency and errors
+            Returns:
+                False if the request must be answered with a 429
+        '''
+        with self.lock:
+            self.request_count += 1
+            throttled = self.rng.random() < self.error_rate
+            if throttled:
+                self.throttled_count += 1
+
+        if self.latency_ms > 0:
+            sleep(self.latency_ms / 1000)
+
+        return not throttled
+
+    def client_config(self, **overrides):
+        '''
+            Returns:
+                A config for enlightenAPI_v4 that calls this server, without call budget limits or persisted state
+        '''
+        config = {
+            "name": "Fake",
+            "system_id": self.data.system_ids[0],
+            "code": "fake",
+            "api_url": self.api_url,
+            "app_api_key": "fake",
+            "app_client_id": "fake",
+            "app_client_secret": "fake",
+            "access_token": "fake",
+            "refresh_token": "fake",
+            "expiry_date": (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"),
+            "rate_limits": {"per_minute": 1000000, "per_month": 1000000, "state_file": None},
+            "cache": {"mode": "off"}
+        }
+        config.update(overrides)
+
+        return config
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Enphase Enlighten API v4")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--systems", type=int, default=1)
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--latency", type=float, default=0, help="latency added to every response, in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with a 429")
+    args = parser.parse_args()
+
+    server = FakeEnphaseServer(host=args.host, port=args.port, seed=args.seed, systems=args.systems,
+                               history_days=args.history_days, latency_ms=args.latency,
+                               error_rate=args.error_rate, verbose=True)
+    print(f"Fake Enphase API listening on {server.api_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Fetch planning for the telemetry loader.
+# Instead of walking blind weekly windows from the last loaded interval, the planner reads which days are already
+# complete for a (system, telemetry type) stream and plans the smallest set of API windows covering the missing days.
+# Holes in the middle of the history are repaired, and complete windows are never fetched again.
+
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import text
+
+INTERVAL = timedelta(minutes=15)
+
+
+def expected_intervals(day):
+    '''
+    The number of intervals of a local day that can be stored: end_at is a naive local time, so on the autumn daylight
+    saving time change the 4 intervals of the repeated hour share the end_at (and the key) of the first pass.
+        Returns:
+            The number of distinct local end times of the 15 minute intervals of the day: 96, or 92 on the spring
+            daylight saving time change
+    '''
+    start = datetime.combine(day, time.min).timestamp()
+    end = datetime.combine(day + timedelta(days=1), time.min).timestamp()
+    step = INTERVAL.total_seconds()
+
+    return len({datetime.fromtimestamp(start + i * step) for i in range(1, round((end - start) / step) + 1)})
+
+
+def read_coverage(pcon, system_id, type, start_day, end_day):
+    '''
+    Read the number of loaded intervals per day of a stream. An interval ending at midnight belongs to the day before.
+        Returns:
+            A dictionary of day -> (number of intervals, last end_at)
+    '''
+    with pcon.connect() as connection:
+        rows = connection.execute(text(f"""
+            select cast(end_at - interval '1 second' as date) as day, count(*), max(end_at)
+            from {type}
+            where system_id = :system_id
+              and end_at > :start_at
+              and end_at <= :end_at
+            group by 1
+        """), {
+            "system_id": system_id,
+            "start_at": datetime.combine(start_day, time.min),
+            "end_at": datetime.combine(end_day + timedelta(days=1), time.min)
+        }).fetchall()
+
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def find_gaps(coverage, start_day, end_day, now=None, min_age=timedelta(hours=2)):
+    '''
+    Find the runs of incomplete days between start_day and end_day (included). The current day is complete when its
+    last interval is less than min_age old, like the loader never called the API for data younger than 2 hours.
+        Returns:
+            A list of (first day, number of days) tuples
+    '''
+    now = datetime.now() if now is None else now
+    gaps = []
+    day = start_day
+
+    while day <= end_day:
+        count, last_end_at = coverage.get(day, (0, None))
+        if day >= now.date():
+            complete = (last_end_at is not None and last_end_at >= now - min_age) \
+                or now - datetime.combine(day, time.min) < min_age
+        else:
+            complete = count >= expected_intervals(day)
+
+        if not complete:
+            if gaps and gaps[-1][0] + timedelta(days=gaps[-1][1]) == day:
+                gaps[-1] = (gaps[-1][0], gaps[-1][1] + 1)
+            else:
+                gaps.append((day, 1))
+
+        day += timedelta(days=1)
+
+    return gaps
+
+
+def plan_windows(gaps):
+    '''
+    Cover each gap with the fewest API calls: week windows for the bulk of the gap, and a day window when a single
+    day is left over. Windows start at midnight. The loader fetches them bypassing the response cache: their days are
+    incomplete, and a cached response would hold the same holes.
+        Returns:
+            A list of windows, dictionaries with start, end, granularity and the number of days
+    '''
+    windows = []
+    for first_day, days in gaps:
+        weeks = days // 7
+        remainder = days % 7
+
+        granularities = ["week"] * weeks
+        if remainder == 1:
+            granularities.append("day")
+        elif remainder > 1:
+            granularities.append("week")
+
+        start = datetime.combine(first_day, time.min)
+        gap_end = start + timedelta(days=days)
+        for granularity in granularities:
+            end = min(gap_end, start + timedelta(days=7 if granularity == "week" else 1))
+            windows.append({
+                "start": start,
+                "end": end,
+                "granularity": granularity,
+                "days": (end - start).days
+            })
+            start = end
+
+    return windows
+
+
+def plan_fetch(pcon, system_id, type, start_day, end_day=None, now=None, min_age=timedelta(hours=2)):
+    '''
+    Plan the API windows needed to complete a stream between start_day and end_day (default today)
+        Parameters:
+            min_age: the current day is not fetched again while its last interval is younger than min_age
+        Returns:
+            The list of windows of plan_windows
+    '''
+    now = datetime.now() if now is None else now
+    end_day = now.date() if end_day is None else end_day
+
+    coverage = read_coverage(pcon, system_id, type, start_day, end_day)
+    gaps = find_gaps(coverage, start_day, end_day, now=now, min_age=min_age)
+
+    return plan_windows(gaps)
+
+
+def describe_plan(system_id, type, windows):
+    if not windows:
+        return f"{system_id} {type}: complete, nothing to fetch"
+
+    days = sum(w["days"] for w in windows)
+    lines = [f"{system_id} {type}: {len(windows)} calls for {days} missing days"]
+    for w in windows:
+        lines.append(f"    {w['granularity']:<5} {w['start']:%Y-%m-%d} -> {w['end']:%Y-%m-%d} ({w['days']} days)")
+
+    return "\n".join(lines)
@@ -0,0 +1,372 @@
+# Long running ingestion: keeps every (system, telemetry type) stream up to date without running the loader by hand.
+# Enphase publishes telemetry in 15 minute intervals. Each stream runs on a slot of that grid, a few minutes after the
+# interval ends, every interval or every few intervals, whatever the monthly call budget allows for all streams.
+# Failed loads are retried with jittered exponential backoff, 429 (Too Many Requests) and 5xx responses included.
+# The schedule survives restarts in state_file; the loaded data itself is tracked by the ingest watermarks.
+# Health and lag are served as json on /health and in Prometheus text format on /metrics.
+#
+# Run from the repository root:
+#     python ingest_daemon.py [--once]
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+from sqlalchemy import text
+
+import enphase_loader
+from database import create_db_engine
+from enlighten import enlightenAPI_v4
+
+INTERVAL = 900
+
+MONTH = 30 * 24 * 3600
+
+
+def budget_interval(per_month, streams, min_interval=INTERVAL):
+    '''
+        Returns:
+            The shortest multiple of the 15 minute interval, and at least min_interval, at which all streams can run
+            without using more than the monthly call budget (one call per run once the history is complete)
+    '''
+    needed = MONTH * streams / per_month
+    intervals = max(math.ceil(needed / INTERVAL), math.ceil(min_interval / INTERVAL), 1)
+
+    return intervals * INTERVAL
+
+
+def next_slot(now, interval, publish_delay=300, jitter=60):
+    '''
+        Returns:
+            The next run time after now on the 15 minute grid: publish_delay seconds after the end of an interval,
+            every interval seconds, plus a random jitter so streams do not all call the API in the same second
+    '''
+    slot = math.floor((now - publish_delay) / interval) * interval + interval + publish_delay
+
+    return slot + random.uniform(0, jitter)
+
+
+def backoff_delay(failures, base=60, maximum=3600):
+    '''
+        Returns:
+            The delay before retrying after the given number of consecutive failures: exponential, between half and
+            all of base * 2 ^ (failures - 1), capped to maximum
+    '''
+    delay = min(maximum, base * 2 ** (failures - 1))
+
+    return random.uniform(delay / 2, delay)
+
+
+class StreamState:
+
+    def __init__(self, system_id, type, next_run=0, failures=0, status=None, message=None, last_run=None,
+                 last_success=None, rows=0):
+        '''
+        The schedule of one (system, telemetry type) stream
+            Parameters:
+                next_run: the epoch at which the stream is due
+                failures: the number of consecutive failed runs
+                rows: the total number of rows loaded since the state was created
+        '''
+        self.system_id = system_id
+        self.type = type
+        self.next_run = next_run
+        self.failures = failures
+        self.status = status
+        self.message = message
+        self.last_run = last_run
+        self.last_success = last_success
+        self.rows = rows
+
+    def key(self):
+        return f"{self.system_id}/{self.type}"
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class IngestDaemon:
+
+    def __init__(self, api, pcon, system_ids, start_day, types=None, interval=INTERVAL, publish_delay=300,
+                 jitter=60, backoff=60, max_backoff=3600, max_workers=6, telemetry_workers=1, write_options=None,
+                 archive=None, state_file="data/ingest_daemon.json"):
+        '''
+        Initialize the daemon, restoring the stream schedules of a previous run from state_file
+            Parameters:
+                interval: the number of seconds between two runs of a stream, a multiple of 15 minutes
+                publish_delay: the number of seconds after the end of an interval before its data is requested
+                jitter: the maximum number of seconds added to each scheduled run
+                backoff: the delay in seconds after a first failure, doubled on every next failure
+                max_backoff: the maximum delay in seconds after a failure
+                max_workers: the number of streams loaded concurrently
+                archive: a parquet_archive.ParquetArchive the loaded rows are also written to
+                state_file: the json file where the schedules are persisted, None to keep them in memory
+        '''
+        self.api = api
+        self.pcon = pcon
+        self.start_day = start_day
+        self.interval = interval
+        self.publish_delay = publish_delay
+        self.jitter = jitter
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_workers = max_workers
+        self.telemetry_workers = telemetry_workers
+        self.write_options = write_options
+        self.archive = archive
+        self.state_file = state_file
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.started_at = time()
+
+        types = enphase_loader.telemetry_types if types is None else types
+        state = self.__load_state()
+        self.streams = []
+        for system_id in system_ids:
+            for type in types:
+                stream = StreamState(system_id, type)
+                stream.__dict__.update(state.get(stream.key(), {}))
+                self.streams.append(stream)
+
+    def run(self, once=False):
+        '''
+        Run the due streams until stop() is called, or a single time when once is set
+        '''
+        print(f"Ingest daemon: {len(self.streams)} streams, every {self.interval // 60} minutes")
+        while not self.stopped.is_set():
+            now = time()
+            due = [stream for stream in self.streams if once or stream.next_run <= now]
+            if due:
+                self.run_streams(due)
+
+            if once:
+                return
+
+            wait = min(stream.next_run for stream in self.streams) - time()
+            self.stopped.wait(max(1, wait))
+
+    def run_streams(self, streams):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self.run_stream, streams))
+
+        try:
+            enphase_loader.refresh_views(self.pcon, results)
+        except Exception as e:
+            logging.exception(f"Refreshing the views failed: {e}")
+
+        self.__save_state()
+
+    def run_stream(self, stream):
+        # the stream runs again one interval later, so the current day is only fetched when its last interval is
+        # older than that
+        result = enphase_loader.load_stream(self.api, self.pcon, stream.system_id, stream.type, self.start_day,
+                                            self.telemetry_workers, write_options=self.write_options,
+                                            min_age=timedelta(seconds=self.interval), archive=self.archive)
+        now = time()
+
+        with self.lock:
+            stream.last_run = now
+            stream.status = result["status"]
+            stream.rows += result["rows"]
+            if result["status"] == "ok":
+                stream.failures = 0
+                stream.message = None
+                stream.last_success = now
+                stream.next_run = next_slot(now, self.interval, self.publish_delay, self.jitter)
+            else:
+                stream.failures += 1
+                stream.message = f"HTTP {result['http_status']}" if result["http_status"] else result["status"]
+                # the monthly budget only refills slowly, there is no point in retrying soon
+                failures = math.inf if result["status"] == "budget exceeded" else stream.failures
+                delay = backoff_delay(min(failures, 64), self.backoff, self.max_backoff)
+                stream.next_run = now + delay
+                print(f"{stream.system_id} {stream.type}: {stream.message}, "
+                      f"failure {stream.failures}, retrying in {delay:.0f} s")
+
+        return result
+
+    def stop(self):
+        self.stopped.set()
+
+    def health(self):
+        '''
+            Returns:
+                A dictionary with the overall status, and per stream the schedule and the lag: the age of the last
+                interval loaded according to the ingest watermarks
+        '''
+        now = time()
+        with self.pcon.connect() as connection:
+            rows = connection.execute(text("select system_id, telemetry_type, last_end_at from ingest_watermark")).fetchall()
+        last_end_at = {f"{row[0]}/{row[1]}": row[2] for row in rows}
+
+        with self.lock:
+            streams = []
+            for stream in self.streams:
+                end_at = last_end_at.get(stream.key())
+                streams.append({
+                    **stream.to_dict(),
+                    "last_end_at": None if end_at is None else end_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    "lag_seconds": None if end_at is None else now - end_at.timestamp(),
+                    "next_run_seconds": stream.next_run - now
+                })
+
+        # healthy while every stream had a successful run within a few intervals
+        stale_after = 3 * self.interval + self.max_backoff
+        healthy = all(stream["last_success"] is not None and now - stream["last_success"] < stale_after
+                      for stream in streams)
+
+        return {
+            "status": "ok" if healthy else "degraded",
+            "uptime_seconds": now - self.started_at,
+            "interval_seconds": self.interval,
+            "budget": self.api.remaining_budget(),
+            "streams": streams
+        }
+
+    def metrics(self):
+        '''
+            Returns:
+                The health in the Prometheus text exposition format
+        '''
+        health = self.health()
+        lines = [
+            "# TYPE enphase_ingest_up gauge",
+            f"enphase_ingest_up {1 if health['status'] == 'ok' else 0}",
+            "# TYPE enphase_api_budget_remaining gauge",
+            f"enphase_api_budget_remaining{{period=\"month\"}} {health['budget']['per_month']}",
+            f"enphase_api_budget_remaining{{period=\"minute\"}} {health['budget']['per_minute']}"
+        ]
+        gauges = {
+            "enphase_ingest_lag_seconds": "lag_seconds",
+            "enphase_ingest_consecutive_failures": "failures",
+            "enphase_ingest_next_run_seconds": "next_run_seconds",
+            "enphase_ingest_rows_total": "rows"
+        }
+        for name, field in gauges.items():
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            for stream in health["streams"]:
+                if stream[field] is not None:
+                    labels = f"system_id=\"{stream['system_id']}\",type=\"{stream['type']}\""
+                    lines.append(f"{name}{{{labels}}} {stream[field]:.0f}")
+
+        return "\n".join(lines) + "\n"
+
+    def __load_state(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+
+        try:
+            with open(self.state_file) as f:
+                return json.load(f).get("streams", {})
+        except (OSError, ValueError) as e:
+            logging.error(f"Unable to read the daemon state from {self.state_file}: {e}")
+            return {}
+
+    def __save_state(self):
+        if self.state_file is None:
+            return
+
+        with self.lock:
+            state = {
+                "streams": {stream.key(): stream.to_dict() for stream in self.streams},
+                "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp_file, self.state_file)
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        daemon = self.server.ingest_daemon
+        try:
+            if self.path == "/health":
+                health = daemon.health()
+                self.send(200 if health["status"] == "ok" else 503, "application/json", json.dumps(health, indent=4))
+            elif self.path == "/metrics":
+                self.send(200, "text/plain; version=0.0.4", daemon.metrics())
+            else:
+                self.send(404, "text/plain", "not found\n")
+        except Exception as e:
+            logging.exception(f"Health check failed: {e}")
+            self.send(500, "text/plain", f"{e}\n")
+
+    def send(self, status, content_type, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_health(daemon, port, host="0.0.0.0"):
+    httpd = ThreadingHTTPServer((host, port), HealthHandler)
+    httpd.ingest_daemon = daemon
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"Health on http://{host}:{httpd.server_address[1]}/health and /metrics")
+
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the Enphase telemetry in the database up to date")
+    parser.add_argument("--once", action="store_true", help="run all streams a single time and exit")
+    args = parser.parse_args()
+
+    with open('config/enlighten_v4_config.json') as config_file:
+        config = json.load(config_file)
+
+    daemon_config = config.get("daemon", {})
+    ingest_workers = config.get("ingest_workers", len(enphase_loader.telemetry_types))
+
+    api = enlightenAPI_v4(config)
+    pcon = create_db_engine(config, pool_size=ingest_workers + 1, max_overflow=0, echo=config.get("db_echo", False))
+    system_ids = enphase_loader.config_systems(api, pcon, config)
+
+    per_month = config.get("rate_limits", {}).get("per_month", 1000)
+    interval = budget_interval(per_month, len(system_ids) * len(enphase_loader.telemetry_types),
+                               daemon_config.get("min_interval_minutes", 15) * 60)
+
+    daemon = IngestDaemon(api, pcon, system_ids, enphase_loader.config_start_day(config),
+                          interval=interval,
+                          publish_delay=daemon_config.get("publish_delay_minutes", 5) * 60,
+                          jitter=daemon_config.get("jitter_seconds", 60),
+                          backoff=daemon_config.get("backoff_seconds", 60),
+                          max_backoff=daemon_config.get("max_backoff_seconds", 3600),
+                          max_workers=ingest_workers,
+                          telemetry_workers=config.get("telemetry_workers", 1),
+                          write_options=enphase_loader.config_write_options(config),
+                          archive=enphase_loader.config_archive(config),
+                          state_file=daemon_config.get("state_file", "data/ingest_daemon.json"))
+
+    if daemon_config.get("health_port") is not None and not args.once:
+        serve_health(daemon, daemon_config["health_port"])
+
+    signal.signal(signal.SIGTERM, lambda *args: daemon.stop())
+    try:
+        daemon.run(once=args.once)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+    api.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ from modules.input_multidate import *
 from modules.calendar_plot import *
 
 import constants as co
+import data_access
 
 @module.ui
 def calendar_sidebar_ui():
@@ -60,7 +61,7 @@ def calendar_ui():
     )
 
 @module.server
-def calendar_server(input, output, session, data):
+def calendar_server(input, output, session, data, rollups, envelopes):
     # clicked_day = reactive.Value()
     calendar_data = reactive.Value(pd.DataFrame())
     metric = reactive.Value(None)
@@ -69,8 +70,8 @@ def calendar_server(input, output, session, data):
 
     @reactive.Effect
     def update_calendar_data():
-        req(not data().empty, input.in_cal_metric())
-        df = data()
+        req("Day" in rollups(), input.in_cal_metric())
+        df = rollups()["Day"]
         df = df.groupby(["Day", "Month", "Month Name", "Day of Week", "Day of Month"])[input.in_cal_metric()] \
             .sum() \
             .rename("Total") \
@@ -94,17 +95,24 @@ def calendar_server(input, output, session, data):
         metric.set(input.in_cal_metric())
 
 
+    @reactive.Calc
+    def selected_days_data():
+        # only the intervals of the selected days are read, and get their envelopes
+        days = flt_selected_days()
+        df = data(min(days), max(days) + timedelta(days=1))
+
+        return envelopes(df[df["Day"].isin(pd.to_datetime(days))])
+
     @reactive.Calc
     def selected_summary_data():
-        req(flt_selected_days(), not data().empty)
+        req(flt_selected_days())
 
-        df = data()
-        print(flt_selected_days(), type(flt_selected_days()))
-        df = df[["Time of Day",
+        df = selected_days_data()
+        df = df[["Slot",
                  "Max Produced (Global)",
                  "Max Produced (Month)",
                  "Max Produced (Week)",
-                 input.in_cal_metric()]][df["Day"].isin(flt_selected_days())]
+                 input.in_cal_metric()]]
 
         return df
 
@@ -112,10 +120,9 @@ def calendar_server(input, output, session, data):
 
     @reactive.Calc
     def selected_data():
-        req(flt_selected_days(), not data().empty)
+        req(flt_selected_days())
 
-        df = data()
-        print(flt_selected_days(), type(flt_selected_days()))
+        df = selected_days_data()
         selected_metrics = input.in_metric()
 
         if type(selected_metrics) == str:
@@ -126,17 +133,17 @@ def calendar_server(input, output, session, data):
 
         if "Produced" in input.in_metric():
             columns = [
-                "Time of Day",
+                "Slot",
                 "Max Produced (Global)",
                 "Max Produced (Month)",
                 "Max Produced (Week)"
             ] + selected_metrics
         else:
             columns = [
-                "Time of Day"
+                "Slot"
             ] + selected_metrics
 
-        df = df[columns][df["Day"].isin(flt_selected_days())]
+        df = df[columns]
 
         return df
 
@@ -147,6 +154,7 @@ def calendar_server(input, output, session, data):
         req(not selected_data().empty)
 
         df = selected_data().copy()
+        df["Time of Day"] = data_access.slot_labels(df["Slot"])
 
         fig = px.bar(
             df,
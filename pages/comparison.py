@@ -11,6 +11,8 @@ from datetime import date, datetime, timedelta
 from modules.calendar_plot import *
 from .templates import build_sidebar
 
+import data_access
+
 
 @module.ui
 def comp_sidebar_ui():
@@ -36,7 +38,7 @@ def comp_ui():
 
 
 @module.server
-def comp_server(input, output, session, data):
+def comp_server(input, output, session, data, rollups):
     selected_dates = reactive.Value([])
     calendar_data = reactive.Value(pd.DataFrame())
     metric = reactive.Value("Produced")
@@ -45,8 +47,8 @@ def comp_server(input, output, session, data):
 
     @reactive.Effect
     def update_calendar_data():
-        req(not data().empty)
-        df = data()
+        req("Day" in rollups())
+        df = rollups()["Day"]
         df = df.groupby(["Day", "Month", "Month Name", "Day of Week", "Day of Month"])[metric()] \
             .sum() \
             .rename("Total") \
@@ -84,9 +86,13 @@ def comp_server(input, output, session, data):
 
     @reactive.Calc
     def selected_data():
-        df = data()
+        req(flt_selected_days())
+
+        # only the intervals of the selected days are read
+        days = flt_selected_days()
+        df = data(min(days), max(days) + timedelta(days=1))
 
-        df = df[df["Day"].isin(flt_selected_days())]
+        df = df[df["Day"].isin(pd.to_datetime(days))]
 
         return df
 
@@ -96,7 +102,10 @@ def comp_server(input, output, session, data):
         req(not selected_data().empty)
 
         dfs = selected_data()
-        dfs = dfs[["Day","Time of Day","Produced","Consumed","Imported","Exported"]]
+        dfs = dfs[["Day","Slot","Produced","Consumed","Imported","Exported"]].copy()
+        # one color per day
+        dfs["Day"] = dfs["Day"].dt.date
+        dfs["Time of Day"] = data_access.slot_labels(dfs.pop("Slot"))
 
         dfs = dfs.melt(id_vars=["Day","Time of Day"], value_vars=["Produced","Consumed","Imported","Exported"], var_name="Property", value_name="Wh")
 
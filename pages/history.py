@@ -11,6 +11,46 @@ from datetime import date, datetime, timedelta
 import shinycomponents.modalfilter as scmf
 
 import constants as co
+import data_access
+
+
+metrics = ["Produced", "Consumed", "Imported", "Exported", "Charged", "Discharged"]
+
+
+def periods(df, granularity):
+    '''
+        Returns:
+            The start of the Hour, Day or Month of the intervals of df, as timestamps like the periods of the rollups
+    '''
+    if granularity == "Month":
+        return df["Time"].dt.to_period("M").dt.to_timestamp().rename("Month")
+
+    return pd.to_datetime(df[granularity])
+
+
+def period_totals(df, granularity):
+    '''
+        Returns:
+            The totals of the metrics of the intervals of df per Hour, Day or Month
+    '''
+    return df.groupby(periods(df, granularity))[metrics].sum().reset_index()
+
+
+def inner_periods(start, end, granularity):
+    '''
+    The periods whose intervals all lie in the time range: an interval belongs to the period holding its end time
+        Returns:
+            The start of the first of these periods and the end of the last one
+    '''
+    if granularity == "Month":
+        length = pd.DateOffset(months=1)
+    else:
+        length = pd.Timedelta(1, "h" if granularity == "Hour" else "D")
+    inner_start = data_access.period_start(start, granularity)
+    if inner_start < start:
+        inner_start += length
+
+    return inner_start, data_access.period_start(end + data_access.slot_length, granularity)
 
 
 @module.ui
@@ -70,15 +110,14 @@ def history_ui():
 
 
 @module.server
-def history_server(input, output, session, data):
+def history_server(input, output, session, data, rollups, time_extent):
     clicked_timeofday = reactive.Value([])
 
     @reactive.Effect
     def update_time_range():
-        req(not data().empty)
-
-        min_time = data()["Time"].min()
-        max_time = data()["Time"].max()
+        # the whole history, the intervals of the selected range are read when needed
+        min_time, max_time = time_extent()
+        req(min_time is not None)
         # min_time = datetime.now() - timedelta(days=10)
         # max_time = datetime.now()
 
@@ -111,8 +150,8 @@ def history_server(input, output, session, data):
     def data_summary():
         req(input.in_time_range())
 
-        df = data()
-        df = df.groupby("Time of Day")[["Produced","Consumed","Imported","Exported","Charged","Discharged"]] \
+        df = data(input.in_time_range()[0], input.in_time_range()[1])
+        df = df.groupby("Slot")[["Produced","Consumed","Imported","Exported","Charged","Discharged"]] \
             .sum(numeric_only=True) \
             .reset_index()
 
@@ -120,15 +159,36 @@ def history_server(input, output, session, data):
 
     @reactive.Calc
     def data_history():
-        req(input.in_time_range(), input.in_granularity(), not data().empty)
-
-        df = data()
-        df = df[(df["Time"] >= input.in_time_range()[0]) & (df["Time"] <= input.in_time_range()[1])]
+        req(input.in_time_range(), input.in_granularity())
+
+        start, end = (pd.Timestamp(time) for time in input.in_time_range())
+        granularity = input.in_granularity()
+        # without a time of day selection, the loader's rollups already hold the totals of the periods inside the
+        # range; the periods cut by its edges are summed from the intervals in the range
+        if granularity in rollups() and not clicked_timeofday():
+            inner_start, inner_end = inner_periods(start, end, granularity)
+            if inner_start >= inner_end:
+                return period_totals(data(start, end), granularity)
+
+            df = rollups()[granularity]
+            period = pd.to_datetime(df[granularity])
+            df = df.assign(**{granularity: period})[(period >= inner_start) & (period < inner_end)]
+            edges = [period_totals(data(start, inner_start - timedelta(seconds=1)), granularity),
+                     period_totals(data(inner_end, end), granularity)]
+
+            return pd.concat([df] + [edge for edge in edges if not edge.empty]) \
+                .groupby(granularity)[metrics] \
+                .sum() \
+                .reset_index()
+
+        df = data(start, end)
         if clicked_timeofday():
-            df = df[df["Time of Day"].isin(clicked_timeofday())]
-
-        if input.in_granularity() in ["Hour", "Day", "Month"]:
-            df = df.groupby(input.in_granularity()).sum(numeric_only=True).reset_index()
+            # the totals per period of the selected slots, one line per slot in the detail
+            df = df[df["Slot"].isin(clicked_timeofday())]
+            if granularity in ["Hour", "Day", "Month"]:
+                df = df.groupby([periods(df, granularity), "Slot"])[metrics].sum().reset_index()
+        elif granularity in ["Hour", "Day", "Month"]:
+            df = period_totals(df, granularity)
 
         return df
 
@@ -160,6 +220,7 @@ def history_server(input, output, session, data):
 
         df = data_history().copy()
         df["Day"] = pd.to_datetime(df["Day"])
+        df["Time of Day"] = data_access.slot_labels(df["Slot"])
         metrics = input.in_metrics()
 
         rows = (len(metrics) - 1) // 2 + 1
@@ -192,7 +253,8 @@ def history_server(input, output, session, data):
     def out_summary():
         req(not data_summary().empty)
 
-        df = data_summary()
+        df = data_summary().copy()
+        df["Time of Day"] = data_access.slot_labels(df["Slot"])
         print(df.head())
         fig = px.bar(
             df,
@@ -212,10 +274,12 @@ def history_server(input, output, session, data):
         with reactive.isolate():
             current_selection = clicked_timeofday()
 
+        clicked_slots = data_access.label_slots(trace.x[points.point_inds])
+
         # remove already selected
         clicked_timeofday.set(
-            [t for t in trace.x[points.point_inds] if not t in current_selection] +
-            [t for t in current_selection if t not in [t for t in trace.x[points.point_inds]]]
+            [t for t in clicked_slots if not t in current_selection] +
+            [t for t in current_selection if t not in clicked_slots]
         )
 
     @output
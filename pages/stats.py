@@ -10,6 +10,7 @@ from datetime import date, datetime, timedelta
 from .templates import build_sidebar
 
 import constants as co
+import data_access
 
 
 @module.ui
@@ -31,20 +32,20 @@ def stats_server(input, output, session, data):
 
     @reactive.Calc
     def data_stats():
-        req(input.in_granularity(), not data().empty)
+        req(input.in_granularity())
 
-        df = data()
-        df = df.groupby([input.in_granularity(), "Time of Day"])["Produced"] \
+        # the whole history, only the production is read
+        df = data(columns=["Produced"])
+        req(not df.empty)
+        df = df.groupby([input.in_granularity(), "Slot"])["Produced"] \
             .quantile([0.1, 0.25, 0.5, 0.75, 0.9]) \
             .rename("Value") \
-            .rename_axis(index=[input.in_granularity(), "Time of Day", "Level"]) \
+            .rename_axis(index=[input.in_granularity(), "Slot", "Level"]) \
             .unstack()
 
         df.columns = ["10%", "25%", "50%", "75%", "90%"]
         df = df.reset_index()
 
-        print(df.info())
-
         return df
 
 
@@ -65,6 +66,7 @@ def stats_server(input, output, session, data):
 
         for idx, month in enumerate(months):
             df_m = df[df["Month"] == month]
+            time_of_day = data_access.slot_labels(df_m["Slot"])
 
             traces = {
                 "10%": {"legendgroup": "10%-90%", "line": dict(width=0), "fill": None, "fillcolor": None, "showlegend": False },
@@ -77,7 +79,7 @@ def stats_server(input, output, session, data):
             for key, value in traces.items():
                 fig.add_trace(
                     go.Scatter(
-                        x=df_m["Time of Day"],
+                        x=time_of_day,
                         y=df_m[key],
                         fill=value["fill"],
                         line=value["line"],
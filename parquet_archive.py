@@ -0,0 +1,251 @@
+# Parquet archive of the telemetry streams, an alternative to PostgreSQL for the app's reads.
+# Each stream is a dataset partitioned by system, year and month (hive layout, one file per partition):
+#     <directory>/<telemetry type>/system_id=<id>/year=<yyyy>/month=<m>/data.parquet
+# with the column names of constants.column_mapping. Readers only open the partitions matching their system and time
+# range, and only decode the columns they ask for.
+# Next to its partitions, each stream keeps a copy of its ingest watermark (see watermarks.py) in
+# <directory>/<telemetry type>/system_id=<id>/_watermark.json, so the app follows the loader without the database.
+# Needs pyarrow, import this module only when the archive is configured.
+#
+# Fill the archive from the database (run from the repository root):
+#     python parquet_archive.py [--directory data/archive]
+
+import argparse
+import glob
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+import constants as co
+from database import create_db_engine
+
+# the telemetry types of the app, and their column_mapping
+type_mapping = {
+    "production_meter": "production",
+    "consumption": "consumption",
+    "import": "import",
+    "export": "export",
+    "battery": "battery"
+}
+
+# the columns of each type read by the app, signed like the energy_wide view
+app_columns = {
+    "import": {"Imported": 1},
+    "export": {"Exported": -1},
+    "production_meter": {"Produced": 1},
+    "consumption": {"Consumed": -1},
+    "battery": {"Charged": -1, "Discharged": 1, "Charged (Pct)": 1}
+}
+
+
+def month_filter(start=None, end=None):
+    '''
+        Returns:
+            A dataset expression on the year and month partition keys selecting the months between start and end,
+            None when both are None
+    '''
+    year, month = ds.field("year"), ds.field("month")
+    expression = None
+
+    if start is not None:
+        start = pd.Timestamp(start)
+        expression = (year > start.year) | ((year == start.year) & (month >= start.month))
+    if end is not None:
+        end = pd.Timestamp(end)
+        before = (year < end.year) | ((year == end.year) & (month <= end.month))
+        expression = before if expression is None else expression & before
+
+    return expression
+
+
+class ParquetArchive:
+
+    def __init__(self, directory="data/archive"):
+        self.directory = directory
+
+    def partition_path(self, type, system_id, year, month):
+        return os.path.join(self.directory, type, f"system_id={system_id}", f"year={year}", f"month={month}",
+                            "data.parquet")
+
+    def write_frame(self, df, type):
+        '''
+        Merge a telemetry dataframe, as returned by enlightenAPI_v4.telemetry, into the dataset of its type.
+        Rows of intervals already in the archive replace the archived ones.
+            Returns:
+                The number of rows written
+        '''
+        if df.empty or type not in type_mapping:
+            return 0
+
+        mapping = co.column_mapping[type_mapping[type]]
+        df = df.reset_index().rename(columns=mapping)
+        df = df[[column for column in mapping.values() if column in df.columns]]
+        # one type per column across all partition files: the metrics may miss values, and numeric columns of the
+        # database are read as Decimal objects
+        df = df.astype({column: "float64" for column in df.columns if column not in ["System Id", "Time"]})
+
+        for (system_id, year, month), part in df.groupby([df["System Id"], df["Time"].dt.year, df["Time"].dt.month]):
+            self.__merge_partition(self.partition_path(type, system_id, year, month), part)
+
+        return len(df)
+
+    def watermark_path(self, type, system_id):
+        # dataset discovery skips the files starting with "_"
+        return os.path.join(self.directory, type, f"system_id={system_id}", "_watermark.json")
+
+    def write_watermark(self, system_id, type, complete_until=None, last_end_at=None):
+        '''
+        Record the ingest watermark of a stream, once its rows are written. Like in the database, complete_until and
+        last_end_at only ever move forward.
+        '''
+        path = self.watermark_path(type, system_id)
+        watermark = {"complete_until": complete_until, "last_end_at": last_end_at}
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = json.load(f)
+            for key, value in previous.items():
+                if value is not None:
+                    value = datetime.fromisoformat(value)
+                    watermark[key] = value if watermark.get(key) is None else max(value, watermark[key])
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({key: None if value is None else pd.Timestamp(value).isoformat()
+                       for key, value in watermark.items()}, f, indent=4)
+        os.replace(tmp_file, path)
+
+    def read_watermark(self):
+        '''
+            Returns:
+                The ingest watermarks of the archive, like data_access.read_ingest_watermark: a tuple of
+                (system_id, telemetry_type, complete_until, last_end_at) tuples
+        '''
+        rows = []
+        for path in glob.glob(os.path.join(self.directory, "*", "system_id=*", "_watermark.json")):
+            type = os.path.basename(os.path.dirname(os.path.dirname(path)))
+            system_id = int(os.path.basename(os.path.dirname(path)).split("=", 1)[1])
+            with open(path) as f:
+                watermark = json.load(f)
+            rows.append((system_id, type) + tuple(None if watermark.get(key) is None
+                                                  else datetime.fromisoformat(watermark[key])
+                                                  for key in ["complete_until", "last_end_at"]))
+
+        return tuple(sorted(rows))
+
+    def read(self, type, columns=None, system_id=None, start=None, end=None):
+        '''
+        Read a telemetry type, with the column names of constants.column_mapping
+            Parameters:
+                columns: the columns to read, all columns by default
+                system_id: the system to read, all systems by default
+                start, end: only read the intervals ending after start and up to end (included)
+            Returns:
+                A dataframe sorted on System Id and Time, or on those of them in columns
+        '''
+        mapping = co.column_mapping[type_mapping[type]]
+        columns = list(mapping.values()) if columns is None else columns
+        path = os.path.join(self.directory, type)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=columns)
+
+        # conditions on the partition keys skip whole files, the conditions on Time use the row group statistics
+        expressions = [month_filter(start, end)]
+        if system_id is not None:
+            expressions.append(ds.field("system_id") == int(system_id))
+        if start is not None:
+            expressions.append(ds.field("Time") > pa.scalar(pd.Timestamp(start).to_pydatetime()))
+        if end is not None:
+            expressions.append(ds.field("Time") <= pa.scalar(pd.Timestamp(end).to_pydatetime()))
+
+        expression = None
+        for condition in expressions:
+            if condition is not None:
+                expression = condition if expression is None else expression & condition
+
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+        keys = [column for column in ["System Id", "Time"] if column in columns]
+
+        return df.sort_values(keys, ignore_index=True) if keys else df
+
+    def read_energy(self, system_id=None, start=None, end=None, columns=None):
+        '''
+        Read the energy data of the app from the archive, like data_access.read_energy reads the energy_wide view
+            Parameters:
+                columns: the metrics to read (e.g. ["Produced"]), all by default. Only the datasets holding them are
+                         read, and the import dataset for the rows.
+            Returns:
+                A dataframe with the System Id, Time, the six metrics and the battery state of charge, or the
+                requested metrics
+        '''
+        df_all = None
+        for type, signs in app_columns.items():
+            if columns is not None:
+                signs = {column: sign for column, sign in signs.items() if column in columns}
+                if not signs and type != "import":
+                    continue
+
+            df = self.read(type, ["System Id", "Time"] + list(signs), system_id, start, end)
+            for column, sign in signs.items():
+                df[column] = sign * df[column].astype("float64")
+
+            # the import intervals are the rows of the app, like in the energy_wide view
+            df_all = df if df_all is None else df_all.merge(df, how="left", on=["System Id", "Time"])
+
+        return df_all
+
+    def __merge_partition(self, path, df):
+        if os.path.exists(path):
+            df = pd.concat([pq.read_table(path).to_pandas(), df], ignore_index=True)
+
+        df = df.drop_duplicates("Time", keep="last").sort_values("Time")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = path + ".tmp"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_file)
+        os.replace(tmp_file, path)
+
+
+def export_database(pcon, archive, chunksize=500000):
+    '''
+    Copy the telemetry tables of the app and their ingest watermarks from the database into the archive
+    '''
+    for type in type_mapping:
+        rows = 0
+        for df in pd.read_sql(f"select * from {type} order by system_id, end_at", pcon, chunksize=chunksize):
+            rows += archive.write_frame(df.set_index("end_at"), type)
+        print(f"{type}: {rows} rows archived")
+
+    with pcon.connect() as connection:
+        watermarks = connection.execute(text("""
+            select system_id, telemetry_type, complete_until, last_end_at from ingest_watermark
+        """)).fetchall()
+
+    for system_id, type, complete_until, last_end_at in watermarks:
+        if type in type_mapping:
+            archive.write_watermark(system_id, type, complete_until, last_end_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the telemetry of the database into the Parquet archive")
+    parser.add_argument("--directory", default=None, help="the archive directory, archive_directory of the config by default")
+    args = parser.parse_args()
+
+    with open('config/enlighten_v4_config.json') as config_file:
+        config = json.load(config_file)
+
+    archive = ParquetArchive(args.directory or config.get("archive_directory", "data/archive"))
+    start = datetime.now()
+    export_database(create_db_engine(config), archive)
+    print(f"Archive written to {archive.directory} in {datetime.now() - start}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# On disk cache for the responses of the Enphase Enlighten API v4.
+# Responses are stored gzip compressed, in a file named after a hash of the endpoint and its query parameters.
+# Entries expire after a time to live, entries stored without time to live (closed historical windows) never expire.
+# When the cache grows beyond its maximum size, the least recently used entries are removed.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+
+    MODES = ("normal", "replay", "off")
+
+    def __init__(self, directory="data/cache", max_size_mb=200, mode="normal"):
+        '''
+        Initialize the cache
+            Parameters:
+                directory: the directory holding the cached responses
+                max_size_mb: the maximum size of the cache on disk, in MB
+                mode: "normal" to serve fresh entries and store new responses, "replay" to serve every entry regardless
+                      of its age and never call the API, "off" to disable the cache
+        '''
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {self.MODES}")
+
+        self.directory = directory
+        self.max_size = max_size_mb * 1024 * 1024
+        self.mode = mode
+        self.lock = threading.Lock()
+
+        # key -> size in bytes, least recently used first
+        self.index = OrderedDict()
+        self.size = 0
+        self.__build_index()
+
+    @staticmethod
+    def key(endpoint, params=None):
+        '''
+            Returns:
+                The cache key for the endpoint and query parameters. The order of the parameters doesn't matter.
+        '''
+        content = json.dumps({"endpoint": endpoint, "params": params or {}}, sort_keys=True, default=str)
+
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, endpoint, params=None):
+        '''
+            Returns:
+                The cached response, or None if there is no fresh entry.
+                In replay mode, a missing entry raises CacheMiss instead.
+        '''
+        if self.mode == "off":
+            return None
+
+        key = self.key(endpoint, params)
+        entry = self.__read(key)
+
+        if entry is None:
+            if self.mode == "replay":
+                raise CacheMiss(f"No cached response for {endpoint} {params}")
+            return None
+
+        if self.mode != "replay" and entry["expires_at"] is not None and entry["expires_at"] < time():
+            return None
+
+        with self.lock:
+            if key in self.index:
+                self.index.move_to_end(key)
+        # the modification time keeps track of the last use between runs
+        try:
+            os.utime(self.__path(key))
+        except FileNotFoundError:
+            pass
+
+        return entry["result"]
+
+    def put(self, endpoint, params, result, ttl=None):
+        '''
+        Store a response
+            Parameters:
+                ttl: the time to live in seconds, None to keep the entry until it is evicted
+        '''
+        if self.mode != "normal":
+            return
+
+        key = self.key(endpoint, params)
+        entry = {
+            "endpoint": endpoint,
+            "params": params,
+            "stored_at": time(),
+            "expires_at": None if ttl is None else time() + ttl,
+            "result": result
+        }
+
+        path = self.__path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding="utf-8") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.size -= self.index.pop(key, 0)
+            self.index[key] = os.path.getsize(path)
+            self.size += self.index[key]
+            self.__evict()
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.index):
+                self.__remove(key)
+
+    def __read(self, key):
+        path = self.__path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with gzip.open(path, 'rt', encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Removing unreadable cache entry {path}: {e}")
+            with self.lock:
+                self.__remove(key)
+            return None
+
+    def __evict(self):
+        while self.size > self.max_size and len(self.index) > 1:
+            key = next(iter(self.index))
+            self.__remove(key)
+
+    def __remove(self, key):
+        self.size -= self.index.pop(key, 0)
+        try:
+            os.remove(self.__path(key))
+        except FileNotFoundError:
+            pass
+
+    def __build_index(self):
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json.gz"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-len(".json.gz")], stat.st_size))
+
+        for mtime, key, size in sorted(entries):
+            self.index[key] = size
+            self.size += size
+
+    def __path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
@@ -0,0 +1,86 @@
+# Incremental maintenance of the energy rollup tables (energy_rollup_hour, energy_rollup_day, energy_rollup_month).
+# The loader recomputes the hours, days and months touched by each window in the transaction writing its rows, so the
+# rollups commit with the rows and the watermark: hours from the telemetry tables, days from the hour rollup and
+# months from the day rollup.
+# Periods follow the app: an interval belongs to the hour, day and month of its end_at.
+
+from contextlib import nullcontext
+
+from sqlalchemy import text
+
+granularities = {
+    "Hour": "energy_rollup_hour",
+    "Day": "energy_rollup_day",
+    "Month": "energy_rollup_month"
+}
+
+# the telemetry types feeding the rollups
+rollup_types = ["production_meter", "consumption", "import", "export", "battery"]
+
+metrics = ["produced", "consumed", "imported", "exported", "charged", "discharged"]
+
+# one row per telemetry interval and metric, with the sign convention of the app
+telemetry_union = """
+    select system_id, end_at, wh_del as produced, null::bigint as consumed, null::bigint as imported,
+           null::bigint as exported, null::bigint as charged, null::bigint as discharged
+    from production_meter where {filter}
+    union all
+    select system_id, end_at, null, -enwh, null, null, null, null from consumption where {filter}
+    union all
+    select system_id, end_at, null, null, wh_imported, null, null, null from import where {filter}
+    union all
+    select system_id, end_at, null, null, null, -wh_exported, null, null from export where {filter}
+    union all
+    select system_id, end_at, null, null, null, null, -charge_enwh, discharge_enwh from battery where {filter}
+"""
+
+
+def upsert_rollup(table, source, period_expression, filter):
+    sums = ", ".join(f"sum({metric})" for metric in metrics)
+    updates = ", ".join(f"{metric} = excluded.{metric}" for metric in metrics)
+
+    return f"""
+        insert into {table} (system_id, period, {", ".join(metrics)})
+        select system_id, {period_expression}, {sums}
+        from ({source}) source
+        where {filter}
+        group by 1, 2
+        on conflict (system_id, period) do update set {updates}
+    """
+
+
+def refresh_rollups(pcon, system_id, from_end_at, to_end_at, connection=None):
+    '''
+    Recompute the rollups of a system for all periods holding intervals that end between from_end_at and to_end_at
+    (both included)
+        Parameters:
+            connection: a connection with an open transaction to refresh the rollups in, by default they are refreshed
+                        in a transaction of their own
+    '''
+    params = {"system_id": system_id, "from_end_at": from_end_at, "to_end_at": to_end_at}
+
+    hour_filter = "system_id = :system_id and end_at >= date_trunc('hour', cast(:from_end_at as timestamp)) " \
+                  "and end_at < date_trunc('hour', cast(:to_end_at as timestamp)) + interval '1 hour'"
+    day_filter = "system_id = :system_id and period >= date_trunc('day', cast(:from_end_at as timestamp)) " \
+                 "and period < date_trunc('day', cast(:to_end_at as timestamp)) + interval '1 day'"
+    month_filter = "system_id = :system_id and period >= date_trunc('month', cast(:from_end_at as timestamp)) " \
+                   "and period < date_trunc('month', cast(:to_end_at as timestamp)) + interval '1 month'"
+
+    with pcon.begin() if connection is None else nullcontext(connection) as connection:
+        # the streams of a system refresh overlapping periods; serialize them up to the commit, so every refresh
+        # reads the telemetry committed by the others
+        connection.execute(text("select pg_advisory_xact_lock(hashtext('energy_rollup'), cast(:system_id as integer))"),
+                           {"system_id": system_id % 2 ** 31})
+
+        connection.execute(text(upsert_rollup("energy_rollup_hour",
+                                              telemetry_union.format(filter=hour_filter),
+                                              "date_trunc('hour', end_at)",
+                                              "true")), params)
+        connection.execute(text(upsert_rollup("energy_rollup_day",
+                                              "select * from energy_rollup_hour",
+                                              "date_trunc('day', period)",
+                                              day_filter)), params)
+        connection.execute(text(upsert_rollup("energy_rollup_month",
+                                              "select * from energy_rollup_day",
+                                              "date_trunc('month', period)",
+                                              month_filter)), params)
@@ -0,0 +1,197 @@
+# Call budget management for the Enphase Enlighten API v4.
+# The API limits the number of calls per minute and per month, depending on the plan of the application.
+# Every API call takes a token from the per minute bucket and counts against the calendar month. Callers that have to
+# wait are served in order of priority, so the most recent telemetry windows are loaded first and backfills get
+# whatever budget is left.
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from time import time
+
+
+class CallBudgetExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+
+    def __init__(self, capacity, period, tokens=None, updated=None):
+        '''
+        A bucket holding at most capacity tokens, refilled at a rate of capacity tokens per period (in seconds)
+        '''
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity if tokens is None else min(tokens, capacity)
+        self.updated = time() if updated is None else updated
+
+    def refill(self, now=None):
+        now = time() if now is None else now
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / self.period)
+        self.updated = now
+
+    def time_until_available(self, tokens=1):
+        '''
+            Returns:
+                The number of seconds before the bucket holds the requested number of tokens, 0 if it already does
+        '''
+        self.refill()
+        if self.tokens >= tokens:
+            return 0
+
+        return (tokens - self.tokens) * self.period / self.capacity
+
+    def take(self, tokens=1):
+        self.tokens -= tokens
+
+    def to_dict(self):
+        return {"tokens": self.tokens, "updated": self.updated}
+
+
+class MonthlyCounter:
+
+    def __init__(self, limit, month=None, used=0):
+        '''
+        A count of calls that starts again at 0 on the first day of every calendar month, like the monthly quota of
+        the API
+            Parameters:
+                month: the month ("YYYY-MM") the used calls were counted in
+        '''
+        self.limit = limit
+        self.month = month
+        self.used = used
+        self.roll()
+
+    def roll(self):
+        month = datetime.now().strftime("%Y-%m")
+        if month != self.month:
+            self.month = month
+            self.used = 0
+
+    def remaining(self):
+        self.roll()
+
+        return max(0, self.limit - self.used)
+
+    def take(self, calls=1):
+        self.roll()
+        self.used += calls
+
+    def to_dict(self):
+        return {"month": self.month, "used": self.used}
+
+
+class RequestScheduler:
+
+    def __init__(self, per_minute=10, per_month=1000, state_file="data/call_budget.json"):
+        '''
+        Initialize the scheduler, restoring the bucket levels of a previous run from state_file
+            Parameters:
+                per_minute: the number of API calls allowed per minute
+                per_month: the number of API calls allowed per month
+                state_file: the json file where the bucket levels are persisted, None to keep them in memory
+        '''
+        self.state_file = state_file
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.counter = itertools.count()
+
+        state = self.__load_state()
+        self.per_minute = TokenBucket(per_minute, 60, **state.get("per_minute", {}))
+        # the state of former versions kept the month in a token bucket, it is not carried over
+        month_state = state.get("per_month", {})
+        self.per_month = MonthlyCounter(per_month, **{key: month_state[key] for key in ["month", "used"]
+                                                      if key in month_state})
+        # no call is made before this time, after the API answered 429
+        self.paused_until = state.get("paused_until", 0)
+
+    def acquire(self, priority=None):
+        '''
+        Block until the call budget allows a new API call. Waiting callers are served highest priority first,
+        callers without priority go before all others.
+            Parameters:
+                priority: a number, usually the start timestamp of the requested window
+        '''
+        priority = float("inf") if priority is None else priority
+
+        with self.condition:
+            ticket = (-priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    if self.waiting[0] != ticket:
+                        self.condition.wait()
+                        continue
+
+                    if self.per_month.remaining() <= 0:
+                        raise CallBudgetExceeded(f"Monthly call budget of {self.per_month.limit} calls exhausted")
+
+                    wait = max(self.paused_until - time(), self.per_minute.time_until_available())
+                    if wait <= 0:
+                        self.per_minute.take()
+                        self.per_month.take()
+                        self.__save_state()
+                        return
+
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def throttled(self):
+        '''
+        Register a 429 response of the API: the server disagrees with our accounting, so pause all calls for a minute
+        '''
+        with self.condition:
+            logging.warning("API call throttled, pausing calls for a minute")
+            self.paused_until = time() + 60
+            self.__save_state()
+            self.condition.notify_all()
+
+    def remaining(self):
+        '''
+            Returns:
+                The number of calls that can be made right now, and in the rest of the monthly budget
+        '''
+        with self.condition:
+            self.per_minute.refill()
+            paused = time() < self.paused_until
+
+            return {
+                "per_minute": 0 if paused else int(self.per_minute.tokens),
+                "per_month": self.per_month.remaining()
+            }
+
+    def __load_state(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Unable to read call budget state from {self.state_file}: {e}")
+            return {}
+
+    def __save_state(self):
+        if self.state_file is None:
+            return
+
+        state = {
+            "per_minute": self.per_minute.to_dict(),
+            "per_month": self.per_month.to_dict(),
+            "paused_until": self.paused_until,
+            "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp_file, self.state_file)
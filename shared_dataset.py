@@ -0,0 +1,86 @@
+# A dataset loaded once per process and shared read-only by all Shiny sessions.
+# Every snapshot of the dataset gets a new version number. A background thread polls the ingest watermark and loads
+# a new snapshot when it moves; sessions watch version() (e.g. with reactive.poll) and switch to the new snapshot.
+# Snapshots are never modified after they are published, so sessions must not modify the frames they get.
+
+import logging
+import threading
+from time import time
+
+
+class SharedDataset:
+
+    def __init__(self, load, read_watermark, poll_seconds=60):
+        '''
+        Initialize the dataset, nothing is loaded until the first call of get()
+            Parameters:
+                load: a function of the watermark and the current snapshot (None at first), returning a new
+                      snapshot and whether the storage was up to date with the watermark. When it was not (e.g. a
+                      view not refreshed yet), the snapshot is published and loaded again at the next poll.
+                read_watermark: a function returning a cheap, comparable summary of the loaded data
+                poll_seconds: the number of seconds between two watermark checks
+        '''
+        self.load = load
+        self.read_watermark = read_watermark
+        self.poll_seconds = poll_seconds
+        self.snapshot = None
+        self.current_version = 0
+        self.watermark = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def get(self):
+        '''
+        The current snapshot. The first call loads it, and starts the background refresh.
+            Returns:
+                The snapshot returned by load
+        '''
+        if self.snapshot is None:
+            self.refresh()
+            self.start()
+
+        return self.snapshot
+
+    def version(self):
+        return self.current_version
+
+    def refresh(self):
+        '''
+        Load a new snapshot when the watermark moved since the current one was loaded
+            Returns:
+                True when a new snapshot was published
+        '''
+        with self.lock:
+            watermark = self.read_watermark()
+            if self.snapshot is not None and watermark == self.watermark:
+                return False
+
+            start = time()
+            snapshot, complete = self.load(watermark, self.snapshot)
+
+            # publish: sessions reading the previous snapshot keep it until they check the version
+            self.snapshot = snapshot
+            self.watermark = watermark if complete else None
+            self.loaded_at = time()
+            self.current_version += 1
+            print(f"Dataset version {self.current_version} loaded in {self.loaded_at - start:.2f} s")
+
+            return True
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__poll, name="shared-dataset-refresh", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def __poll(self):
+        while not self.stopped.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.exception(f"Refreshing the shared dataset failed: {e}")
@@ -26,7 +26,8 @@ create table production_micro (
     end_at              timestamp,
     devices_reporting   bigint,
     powr                bigint,
-    enwh                bigint
+    enwh                bigint,
+    primary key (system_id, end_at)
 );
 
 drop table production_meter;
@@ -34,7 +35,8 @@ create table production_meter (
     system_id           bigint,
     end_at              timestamp,
     devices_reporting   bigint,
-    wh_del              bigint
+    wh_del              bigint,
+    primary key (system_id, end_at)
 );
 
 drop table battery;
@@ -46,7 +48,8 @@ create table battery (
     discharge_enwh              bigint,
     discharge_devices_reporting bigint,
     soc_percent                 numeric(4, 1),
-	soc_devices_reporting		bigint
+	soc_devices_reporting		bigint,
+    primary key (system_id, end_at)
 );
 
 
@@ -54,18 +57,94 @@ create table consumption (
     system_id           bigint,
     end_at              timestamp,
     devices_reporting   bigint,
-    enwh                bigint
+    enwh                bigint,
+    primary key (system_id, end_at)
 );
 
 
 create table export (
     system_id           bigint,
     end_at              timestamp,
-    wh_exported         bigint
+    wh_exported         bigint,
+    primary key (system_id, end_at)
 );
 
 create table import (
     system_id           bigint,
     end_at              timestamp,
-    wh_imported         bigint
+    wh_imported         bigint,
+    primary key (system_id, end_at)
 );
+
+
+create table systems (
+    system_id           bigint primary key,
+    name                text,
+    timezone            text,
+    system_size         bigint,
+    status              text,
+    operational_at      timestamp,
+    last_report_at      timestamp,
+    active              boolean not null default true,
+    updated_at          timestamp not null default now()
+);
+
+
+-- Per (system, telemetry type) stream, maintained by the loader (see watermarks.py): all days from complete_from up
+-- to complete_until are loaded, last_end_at is the last interval written, and the last load attempt and its outcome.
+create table ingest_watermark (
+    system_id           bigint,
+    telemetry_type      text,
+    complete_from       date,
+    complete_until      timestamp,
+    last_end_at         timestamp,
+    last_attempt_at     timestamp,
+    last_success_at     timestamp,
+    status              text,
+    message             text,
+    primary key (system_id, telemetry_type)
+);
+
+
+-- Rollups of the six energy metrics per system, maintained incrementally by the loader (see rollups.py).
+-- Values follow the sign convention of the app: consumed, exported and charged energy are negative.
+create table energy_rollup_hour (
+    system_id           bigint,
+    period              timestamp,
+    produced            bigint,
+    consumed            bigint,
+    imported            bigint,
+    exported            bigint,
+    charged             bigint,
+    discharged          bigint,
+    primary key (system_id, period)
+);
+
+create table energy_rollup_day (like energy_rollup_hour including all);
+
+create table energy_rollup_month (like energy_rollup_hour including all);
+
+
+-- The telemetry of the app in one row per system and interval: the import intervals, joined with the other streams,
+-- with the sign convention of the app (consumed, exported and charged energy are negative) and the metrics typed as
+-- double precision, as pandas would hold them. Refreshed concurrently by the loader after each ingest.
+create materialized view energy_wide as
+select i.system_id,
+       i.end_at,
+       p.wh_del::double precision              as produced,
+       (-c.enwh)::double precision             as consumed,
+       i.wh_imported::double precision         as imported,
+       (-e.wh_exported)::double precision      as exported,
+       (-b.charge_enwh)::double precision      as charged,
+       b.discharge_enwh::double precision      as discharged,
+       b.soc_percent::double precision         as soc_percent
+from import i
+left join export e using (system_id, end_at)
+left join production_meter p using (system_id, end_at)
+left join consumption c using (system_id, end_at)
+left join battery b using (system_id, end_at);
+
+-- required by "refresh materialized view concurrently"
+create unique index energy_wide_pkey on energy_wide (system_id, end_at);
+-- the app reads time ranges of all systems
+create index energy_wide_end_at on energy_wide (end_at);
@@ -0,0 +1,126 @@
+-- Partitioned schema mode for the telemetry tables.
+-- Use instead of the telemetry tables of create_db.sql, and set "schema_mode": "partitioned" in the config so the
+-- loader creates the monthly partitions it writes to.
+--
+-- Every telemetry table is range partitioned on end_at, one partition per month. Each partition gets
+--   * the primary key (system_id, end_at), a btree serving the per system watermark and time range lookups
+--   * a BRIN index on end_at, a few pages large, for time range scans over all systems: rows are appended in
+--     end_at order, so the block ranges of the BRIN index stay tight
+-- Queries filtering on end_at only open the partitions of the requested months.
+
+\c enlighten enl
+
+create or replace function ensure_monthly_partition(parent text, month date) returns text as $$
+declare
+    month_start date := date_trunc('month', month);
+    partition_name text := format('%s_y%sm%s', parent, to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+begin
+    -- "if not exists" as well, streams of several systems may ask for the same partition at the same time
+    if to_regclass(partition_name) is null then
+        execute format('create table if not exists %I partition of %I for values from (%L) to (%L)',
+                       partition_name, parent, month_start, month_start + interval '1 month');
+        execute format('create index if not exists %I on %I using brin (end_at) with (pages_per_range = 32)',
+                       partition_name || '_end_at_brin', partition_name);
+    end if;
+
+    return partition_name;
+end
+$$ language plpgsql;
+
+
+create or replace function ensure_monthly_partitions(parent text, from_month date, to_month date) returns void as $$
+declare
+    month date := date_trunc('month', from_month);
+begin
+    while month <= to_month loop
+        perform ensure_monthly_partition(parent, month);
+        month := month + interval '1 month';
+    end loop;
+end
+$$ language plpgsql;
+
+
+-- energy_wide (see create_db.sql) depends on the telemetry tables, it is recreated at the end
+drop materialized view if exists energy_wide;
+
+drop table if exists production_micro;
+create table production_micro (
+    system_id           bigint not null,
+    end_at              timestamp not null,
+    devices_reporting   bigint,
+    powr                bigint,
+    enwh                bigint,
+    primary key (system_id, end_at)
+) partition by range (end_at);
+
+drop table if exists production_meter;
+create table production_meter (
+    system_id           bigint not null,
+    end_at              timestamp not null,
+    devices_reporting   bigint,
+    wh_del              bigint,
+    primary key (system_id, end_at)
+) partition by range (end_at);
+
+drop table if exists battery;
+create table battery (
+    system_id                   bigint not null,
+    end_at                      timestamp not null,
+    charge_enwh                 bigint,
+    charge_devices_reporting    bigint,
+    discharge_enwh              bigint,
+    discharge_devices_reporting bigint,
+    soc_percent                 numeric(4, 1),
+    soc_devices_reporting       bigint,
+    primary key (system_id, end_at)
+) partition by range (end_at);
+
+drop table if exists consumption;
+create table consumption (
+    system_id           bigint not null,
+    end_at              timestamp not null,
+    devices_reporting   bigint,
+    enwh                bigint,
+    primary key (system_id, end_at)
+) partition by range (end_at);
+
+drop table if exists export;
+create table export (
+    system_id           bigint not null,
+    end_at              timestamp not null,
+    wh_exported         bigint,
+    primary key (system_id, end_at)
+) partition by range (end_at);
+
+drop table if exists import;
+create table import (
+    system_id           bigint not null,
+    end_at              timestamp not null,
+    wh_imported         bigint,
+    primary key (system_id, end_at)
+) partition by range (end_at);
+
+-- partitions for the current month and the next one, the loader adds the others when it needs them
+select ensure_monthly_partitions(t, current_date, (current_date + interval '1 month')::date)
+from unnest(array['production_micro', 'production_meter', 'battery', 'consumption', 'export', 'import']) as t;
+
+create materialized view energy_wide as
+select i.system_id,
+       i.end_at,
+       p.wh_del::double precision              as produced,
+       (-c.enwh)::double precision             as consumed,
+       i.wh_imported::double precision         as imported,
+       (-e.wh_exported)::double precision      as exported,
+       (-b.charge_enwh)::double precision      as charged,
+       b.discharge_enwh::double precision      as discharged,
+       b.soc_percent::double precision         as soc_percent
+from import i
+left join export e using (system_id, end_at)
+left join production_meter p using (system_id, end_at)
+left join consumption c using (system_id, end_at)
+left join battery b using (system_id, end_at);
+
+-- required by "refresh materialized view concurrently"
+create unique index energy_wide_pkey on energy_wide (system_id, end_at);
+-- the app reads time ranges of all systems
+create index energy_wide_end_at on energy_wide (end_at);
@@ -0,0 +1,37 @@
+-- One-off migration for databases created before the telemetry tables had a primary key.
+-- Removes duplicate (system_id, end_at) rows, keeping the last loaded one, and adds the primary keys the loader
+-- needs to upsert. Run with: psql -U enl -d enlighten -f sql/migrations/001_dedup_primary_keys.sql
+
+\set ON_ERROR_STOP on
+
+begin;
+
+do $$
+declare
+    t text;
+    removed bigint;
+begin
+    foreach t in array array['production_micro', 'production_meter', 'battery', 'consumption', 'export', 'import']
+    loop
+        execute format('delete from %I where system_id is null or end_at is null', t);
+
+        execute format('
+            delete from %1$I
+            where ctid in (
+                select ctid
+                from (
+                    select ctid, row_number() over (partition by system_id, end_at order by ctid desc) as rn
+                    from %1$I
+                ) ranked
+                where rn > 1
+            )', t);
+        get diagnostics removed = row_count;
+        raise notice '%: % duplicate rows removed', t, removed;
+
+        execute format('alter table %1$I add primary key (system_id, end_at)', t);
+        execute format('analyze %I', t);
+    end loop;
+end
+$$;
+
+commit;
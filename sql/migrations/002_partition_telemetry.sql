@@ -0,0 +1,47 @@
+-- One-off migration from the plain telemetry tables of create_db.sql to the partitioned schema mode of
+-- create_db_partitioned.sql. Run 001_dedup_primary_keys.sql first, then the functions section of
+-- create_db_partitioned.sql (ensure_monthly_partition and ensure_monthly_partitions), then this script:
+--     psql -U enl -d enlighten -f sql/migrations/002_partition_telemetry.sql
+-- Afterwards set "schema_mode": "partitioned" in the config.
+
+\set ON_ERROR_STOP on
+
+begin;
+
+do $$
+declare
+    t text;
+    min_end_at timestamp;
+    max_end_at timestamp;
+    heap_count bigint;
+    partitioned_count bigint;
+begin
+    foreach t in array array['production_micro', 'production_meter', 'battery', 'consumption', 'export', 'import']
+    loop
+        execute format('alter table %I rename to %I', t, t || '_heap');
+        execute format('alter index if exists %I rename to %I', t || '_pkey', t || '_heap_pkey');
+        execute format('create table %I (like %I including defaults including indexes) partition by range (end_at)',
+                       t, t || '_heap');
+
+        execute format('select min(end_at), max(end_at), count(*) from %I', t || '_heap')
+            into min_end_at, max_end_at, heap_count;
+
+        perform ensure_monthly_partitions(t,
+                                          coalesce(min_end_at, current_date)::date,
+                                          (greatest(coalesce(max_end_at, current_date), current_date) + interval '1 month')::date);
+
+        execute format('insert into %I select * from %I order by end_at', t, t || '_heap');
+        execute format('select count(*) from %I', t) into partitioned_count;
+
+        if partitioned_count <> heap_count then
+            raise exception '%: % rows copied, % expected', t, partitioned_count, heap_count;
+        end if;
+
+        execute format('drop table %I', t || '_heap');
+        execute format('analyze %I', t);
+        raise notice '%: % rows moved to monthly partitions', t, partitioned_count;
+    end loop;
+end
+$$;
+
+commit;
@@ -0,0 +1,50 @@
+-- One-off migration adding the hourly, daily and monthly energy rollups to an existing database.
+-- The tables are filled from the loaded telemetry here, the loader keeps them up to date afterwards.
+--     psql -U enl -d enlighten -f sql/migrations/003_energy_rollups.sql
+
+\set ON_ERROR_STOP on
+
+begin;
+
+create table energy_rollup_hour (
+    system_id           bigint,
+    period              timestamp,
+    produced            bigint,
+    consumed            bigint,
+    imported            bigint,
+    exported            bigint,
+    charged             bigint,
+    discharged          bigint,
+    primary key (system_id, period)
+);
+
+create table energy_rollup_day (like energy_rollup_hour including all);
+
+create table energy_rollup_month (like energy_rollup_hour including all);
+
+insert into energy_rollup_hour
+select system_id, date_trunc('hour', end_at), sum(produced), sum(consumed), sum(imported), sum(exported), sum(charged), sum(discharged)
+from (
+    select system_id, end_at, wh_del as produced, null::bigint as consumed, null::bigint as imported, null::bigint as exported, null::bigint as charged, null::bigint as discharged from production_meter
+    union all
+    select system_id, end_at, null, -enwh, null, null, null, null from consumption
+    union all
+    select system_id, end_at, null, null, wh_imported, null, null, null from import
+    union all
+    select system_id, end_at, null, null, null, -wh_exported, null, null from export
+    union all
+    select system_id, end_at, null, null, null, null, -charge_enwh, discharge_enwh from battery
+) telemetry
+group by 1, 2;
+
+insert into energy_rollup_day
+select system_id, date_trunc('day', period), sum(produced), sum(consumed), sum(imported), sum(exported), sum(charged), sum(discharged)
+from energy_rollup_hour
+group by 1, 2;
+
+insert into energy_rollup_month
+select system_id, date_trunc('month', period), sum(produced), sum(consumed), sum(imported), sum(exported), sum(charged), sum(discharged)
+from energy_rollup_day
+group by 1, 2;
+
+commit;
@@ -0,0 +1,30 @@
+-- One-off migration adding the energy_wide materialized view of create_db.sql to an existing database.
+-- The loader refreshes it after each ingest, the app reads it instead of joining the telemetry tables itself.
+--     psql -U enl -d enlighten -f sql/migrations/004_energy_wide_view.sql
+-- The view depends on the telemetry tables: to migrate to the partitioned schema mode later, drop it before running
+-- 002_partition_telemetry.sql and run this script again afterwards.
+
+\set ON_ERROR_STOP on
+
+begin;
+
+create materialized view energy_wide as
+select i.system_id,
+       i.end_at,
+       p.wh_del::double precision              as produced,
+       (-c.enwh)::double precision             as consumed,
+       i.wh_imported::double precision         as imported,
+       (-e.wh_exported)::double precision      as exported,
+       (-b.charge_enwh)::double precision      as charged,
+       b.discharge_enwh::double precision      as discharged,
+       b.soc_percent::double precision         as soc_percent
+from import i
+left join export e using (system_id, end_at)
+left join production_meter p using (system_id, end_at)
+left join consumption c using (system_id, end_at)
+left join battery b using (system_id, end_at);
+
+-- required by "refresh materialized view concurrently"
+create unique index energy_wide_pkey on energy_wide (system_id, end_at);
+
+commit;
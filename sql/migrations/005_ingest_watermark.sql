@@ -0,0 +1,23 @@
+-- One-off migration adding the ingest_watermark table of create_db.sql to an existing database.
+-- The table starts empty: the first run of the loader reads the coverage of the whole history once, and records
+-- the watermarks of the streams.
+--     psql -U enl -d enlighten -f sql/migrations/005_ingest_watermark.sql
+
+\set ON_ERROR_STOP on
+
+begin;
+
+create table ingest_watermark (
+    system_id           bigint,
+    telemetry_type      text,
+    complete_from       date,
+    complete_until      timestamp,
+    last_end_at         timestamp,
+    last_attempt_at     timestamp,
+    last_success_at     timestamp,
+    status              text,
+    message             text,
+    primary key (system_id, telemetry_type)
+);
+
+commit;
@@ -0,0 +1,7 @@
+-- One-off migration adding the end_at index of the energy_wide view of create_db.sql to an existing database.
+-- The app reads the recent days and the time ranges shown by the pages, of all systems.
+--     psql -U enl -d enlighten -f sql/migrations/006_energy_wide_time_index.sql
+
+\set ON_ERROR_STOP on
+
+create index if not exists energy_wide_end_at on energy_wide (end_at);
@@ -0,0 +1,21 @@
+-- One-off migration adding the systems registry table of create_db.sql to an existing database.
+-- The table starts empty: the next run of the loader in fleet mode registers the systems returned by the API.
+--     psql -U enl -d enlighten -f sql/migrations/007_systems_registry.sql
+
+\set ON_ERROR_STOP on
+
+begin;
+
+create table systems (
+    system_id           bigint primary key,
+    name                text,
+    timezone            text,
+    system_size         bigint,
+    status              text,
+    operational_at      timestamp,
+    last_report_at      timestamp,
+    active              boolean not null default true,
+    updated_at          timestamp not null default now()
+);
+
+commit;
@@ -0,0 +1,104 @@
+# Ingest watermarks: per (system, telemetry type) stream, how far the history is known to be complete, and how the
+# last load went (sql/create_db.sql, table ingest_watermark).
+# The loader advances complete_until in the transaction writing the rows, so a watermark never runs ahead of the
+# data, and the fetch planner only reads the coverage of the days after it.
+
+from datetime import timedelta
+
+from sqlalchemy import text
+
+import fetch_planner
+
+
+def read_watermark(pcon, system_id, type):
+    '''
+        Returns:
+            The ingest_watermark row of the stream as a dictionary, None when the stream was never loaded
+    '''
+    with pcon.connect() as connection:
+        row = connection.execute(text("""
+            select * from ingest_watermark where system_id = :system_id and telemetry_type = :type
+        """), {"system_id": system_id, "type": type}).mappings().first()
+
+    return None if row is None else dict(row)
+
+
+def resume_day(watermark, start_day):
+    '''
+        Returns:
+            The first day whose coverage must be read to complete the stream from start_day: the day of complete_until,
+            unless the watermark was computed from a later start day
+    '''
+    if watermark is None or watermark["complete_until"] is None or watermark["complete_from"] > start_day:
+        return start_day
+
+    return max(start_day, watermark["complete_until"].date())
+
+
+def window_complete_until(connection, system_id, type, window, closed_before):
+    '''
+    Find how far the days of a fetched (midnight to midnight) window are complete: a day is complete when all its
+    intervals are loaded, or when it ended before closed_before, the API answered for it and won't publish more.
+    Streams without data for a period, like the battery of a site without battery or a system installed after the
+    start day, never get all their intervals.
+        Returns:
+            The end of the leading complete days of the window
+    '''
+    rows = connection.execute(text(f"""
+        select cast(end_at - interval '1 second' as date), count(*)
+        from {type}
+        where system_id = :system_id and end_at > :start_at and end_at <= :end_at
+        group by 1
+    """), {"system_id": system_id, "start_at": window["start"], "end_at": window["end"]}).fetchall()
+    loaded = {row[0]: row[1] for row in rows}
+
+    day = window["start"]
+    while day < window["end"]:
+        day_end = day + timedelta(days=1)
+        if day_end > closed_before and loaded.get(day.date(), 0) < fetch_planner.expected_intervals(day.date()):
+            break
+        day = day_end
+
+    return day
+
+
+def advance_watermark(connection, system_id, type, start_day, complete_until=None, last_end_at=None):
+    '''
+    Record a load attempt of the stream, in the transaction of connection. For a given start day, complete_until and
+    last_end_at only ever move forward.
+    '''
+    connection.execute(text("""
+        insert into ingest_watermark (system_id, telemetry_type, complete_from, complete_until, last_end_at,
+                                      last_attempt_at, status)
+        values (:system_id, :type, :start_day, :complete_until, :last_end_at, localtimestamp, 'loading')
+        on conflict (system_id, telemetry_type) do update set
+            complete_from = least(ingest_watermark.complete_from, excluded.complete_from),
+            -- an earlier start day invalidates the old complete_until, the loader completes the stream from there
+            complete_until = case when excluded.complete_from < ingest_watermark.complete_from
+                                  then excluded.complete_until
+                                  else greatest(ingest_watermark.complete_until, excluded.complete_until) end,
+            last_end_at = greatest(ingest_watermark.last_end_at, excluded.last_end_at),
+            last_attempt_at = excluded.last_attempt_at,
+            status = excluded.status
+    """), {
+        "system_id": system_id,
+        "type": type,
+        "start_day": start_day,
+        "complete_until": complete_until,
+        "last_end_at": last_end_at
+    })
+
+
+def record_status(pcon, system_id, type, start_day, status, message=None):
+    '''
+    Record the outcome of a load of the stream ("ok", "failed", "budget exceeded")
+    '''
+    with pcon.begin() as connection:
+        advance_watermark(connection, system_id, type, start_day)
+        connection.execute(text("""
+            update ingest_watermark
+            set status = :status,
+                message = :message,
+                last_success_at = case when :status = 'ok' then localtimestamp else last_success_at end
+            where system_id = :system_id and telemetry_type = :type
+        """), {"system_id": system_id, "type": type, "status": status, "message": message})